@@ -1,67 +1,511 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import zipfile
 from contextlib import asynccontextmanager
-from typing import Optional
+from pathlib import Path
+from typing import AsyncIterator, Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from commons import FormData
-from .db import Report, SubmissionState, load_db, save_db
-from .file_to_metrics import parse_excel_to_metrics, parse_text_to_metrics
+from .aggregation import (
+    DERIVED_METRICS,
+    METRICS,
+    AggregateRow,
+    GroupBy,
+    PortfolioFrame,
+    Statistic,
+)
+from .batch import BatchDocument, BatchItemResult, expand_archives, parse_batch
+from .cache import CacheStats
+from .db import PERIOD_PATTERN, Report, ReportPage, ReportStore, SubmissionState
+from .dedup import DuplicateIndex, Fingerprint, fingerprint
+from .email_import import MAIL_STORE_BATCH, import_messages, iter_messages
+from .export import COLUMNS, EXPORTERS, MEDIA_TYPES, ExportFormat
+from .file_to_metrics import (
+    FieldUpdate,
+    extract_metrics_async,
+    extract_metrics_stream,
+    extraction_cache,
+    parse_pool,
+    file_to_text_async,
+    load_prompt_template,
+)
+from .jobs import Job, JobQueue
+from .monitoring import configure_logging, count_failure, track_gauges
+from .snapshot import (
+    SNAPSHOT_MEDIA_TYPES,
+    ColumnarSnapshot,
+    SnapshotFormat,
+    serialize_table,
+)
+from .tracing import RequestTracingMiddleware
+from .validation import ReportValidation, Severity, ValidationIndex
 
 
-db: list[Report] = []
+store = ReportStore.from_env()
+portfolio = PortfolioFrame()
+store.subscribe(portfolio.update)
+duplicate_index = DuplicateIndex()
+store.subscribe(duplicate_index.update)
+snapshot = ColumnarSnapshot.from_env()
+store.subscribe(snapshot.update)
+validation_index = ValidationIndex()
+store.subscribe(validation_index.update)
+
+
+async def process_job(job: Job, file_bytes: bytes) -> FormData:
+    """Extracts the metrics of a background job, reusing the ones of a near-duplicate
+    like the synchronous upload does."""
+    try:
+        content_text = await file_to_text_async(job.file_name, file_bytes)
+    except Exception as e:
+        count_failure(e)
+        raise
+    document = fingerprint(content_text)
+    job.fingerprint = None if document is None else str(document)
+    duplicate = _find_duplicate(job.company_id, document)
+    if duplicate is not None:
+        job.duplicate_of = duplicate.id
+        return duplicate.form_data
+    try:
+        return await extract_metrics_async(content_text, load_prompt_template())
+    except Exception as e:
+        count_failure(e)
+        raise
+
+
+def store_job_result(job: Job) -> None:
+    if job.result is not None:
+        # Named after the job, so that a job run again after a crash replaces its
+        # report instead of adding another one
+        store.put(
+            Report(
+                id=job.id,
+                company_id=job.company_id,
+                period=job.period,
+                form_data=job.result,
+                state=SubmissionState.DRAFT,
+                fingerprint=job.fingerprint,
+            )
+        )
+
+
+job_queue = JobQueue.from_env(process=process_job, on_done=store_job_result)
+
+configure_logging()
+track_gauges(stored_reports=lambda: len(store), queue_depth=job_queue.depth)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global db
-    db = load_db()
+    store.open()
+    snapshot.open()
+    validation_index.open()
+    await job_queue.start()
     yield
-    save_db(db)
+    await job_queue.stop()
+    parse_pool.shutdown()
+    store.close()
 
 
 app = FastAPI(title="Investor Reporting API", version="0.1", lifespan=lifespan)
+app.add_middleware(RequestTracingMiddleware)
 
 
 @app.post("/startup-report/file")
-async def parse_startup_report(file: UploadFile = File(...)):
+async def parse_startup_report(
+    file: UploadFile = File(...),
+    background: bool = False,
+    company_id: Optional[str] = None,
+    period: Optional[str] = Query(default=None, pattern=PERIOD_PATTERN),
+):
+    """Extracts the metrics from an uploaded file.
+
+    With ``background=true`` the extraction is enqueued and the job is returned right
+    away: its status can then be polled on ``/jobs/{job_id}``.
+
+    If the company already sent a near-identical document stating the same numbers,
+    e.g. with a different greeting, its metrics are reused without calling the LLM
+    and the id of its report is returned in the ``X-Duplicate-Of`` header.
+
+    """
     try:
         file_bytes = await file.read()
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Couldn't read file: {str(e)}")
-    try:
-        file_content = file_bytes.decode("utf-8")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Couldn't decode file: {str(e)}")
     if file.filename is None:
         raise HTTPException(status_code=400, detail="File name is required")
     else:
         file_name = file.filename
+    if background:
+        job = job_queue.submit(file_name, file_bytes, company_id, period)
+        return JSONResponse(status_code=202, content=job.model_dump(mode="json"))
     try:
-        if file_name.endswith((".xlsx", ".xls")):
-            metrics = parse_excel_to_metrics(file_content)
+        content_text = await file_to_text_async(file_name, file_bytes)
+        document = fingerprint(content_text)
+        duplicate = _find_duplicate(company_id, document)
+        if duplicate is None:
+            template_text = load_prompt_template()
+            metrics = await extract_metrics_async(content_text, template_text)
         else:
-            # Assume text/CSV file parsing
-            file_content = file_bytes.decode("utf-8")
-            metrics = parse_text_to_metrics(file_content)
-        db.append(Report(form_data=metrics, state=SubmissionState.DRAFT))
-        return JSONResponse(content=metrics.model_dump())
+            metrics = duplicate.form_data
+    except UnicodeDecodeError as e:
+        count_failure(e)
+        raise HTTPException(status_code=400, detail=f"Couldn't decode file: {str(e)}")
     except Exception as e:
+        count_failure(e)
         raise HTTPException(status_code=400, detail=f"Failed to parse Excel: {str(e)}")
+    store.put(
+        Report(
+            company_id=company_id,
+            period=period,
+            form_data=metrics,
+            state=SubmissionState.DRAFT,
+            fingerprint=None if document is None else str(document),
+        )
+    )
+    headers = {} if duplicate is None else {"X-Duplicate-Of": duplicate.id}
+    return JSONResponse(content=metrics.model_dump(mode="json"), headers=headers)
+
+
+def _find_duplicate(
+    company_id: str | None, document: Fingerprint | None
+) -> Report | None:
+    """Returns the report of the company extracted from a near-identical document, so
+    that its metrics can be reused instead of extracting them again."""
+    if company_id is None or document is None:
+        return None
+    duplicate = duplicate_index.find(company_id, document)
+    if duplicate is not None:
+        logger.info(f"Near-duplicate of report '{duplicate.id}', reusing its metrics.")
+    return duplicate
+
+
+async def _reuse_metrics(form_data: FormData) -> AsyncIterator[FieldUpdate | FormData]:
+    """Streams the metrics of a near-duplicate like `extract_metrics_stream` would."""
+    for name, value in form_data.model_dump(mode="json").items():
+        if value is not None:
+            yield FieldUpdate(name, value)
+    yield form_data
+
+
+def _sse_event(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/startup-report/file/stream")
+async def stream_startup_report(
+    file: UploadFile = File(...),
+    company_id: Optional[str] = None,
+    period: Optional[str] = Query(default=None, pattern=PERIOD_PATTERN),
+) -> StreamingResponse:
+    """Extracts the metrics from an uploaded file as a stream of Server-Sent Events.
+
+    A ``field`` event, like ``{"name": "arr", "value": "7100000"}``, is sent as soon as
+    each field is extracted. The last event is either ``done``, with the id of the
+    stored draft, the complete metrics and the id of the report they were reused from
+    if the document is a near-duplicate, or ``error``.
+
+    """
+    try:
+        file_bytes = await file.read()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Couldn't read file: {str(e)}")
+    if file.filename is None:
+        raise HTTPException(status_code=400, detail="File name is required")
+    try:
+        content_text = await file_to_text_async(file.filename, file_bytes)
+    except UnicodeDecodeError as e:
+        count_failure(e)
+        raise HTTPException(status_code=400, detail=f"Couldn't decode file: {str(e)}")
+    except Exception as e:
+        count_failure(e)
+        raise HTTPException(status_code=400, detail=f"Failed to parse Excel: {str(e)}")
+
+    document = fingerprint(content_text)
+    duplicate = _find_duplicate(company_id, document)
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            if duplicate is None:
+                template_text = load_prompt_template()
+                updates = extract_metrics_stream(content_text, template_text)
+            else:
+                updates = _reuse_metrics(duplicate.form_data)
+            async for update in updates:
+                if isinstance(update, FieldUpdate):
+                    yield _sse_event("field", update._asdict())
+                    continue
+                report = store.put(
+                    Report(
+                        company_id=company_id,
+                        period=period,
+                        form_data=update,
+                        state=SubmissionState.DRAFT,
+                        fingerprint=None if document is None else str(document),
+                    )
+                )
+                yield _sse_event(
+                    "done",
+                    {
+                        "report_id": report.id,
+                        "form_data": update.model_dump(mode="json"),
+                        "duplicate_of": None if duplicate is None else duplicate.id,
+                    },
+                )
+        except Exception as e:
+            count_failure(e)
+            logger.exception("Streamed extraction failed.")
+            yield _sse_event("error", {"detail": f"Failed to extract metrics: {e}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/startup-report/batch")
+async def parse_startup_report_batch(
+    files: list[UploadFile] = File(...),
+    company_ids: Optional[list[str]] = Query(default=None),
+    period: Optional[str] = Query(default=None, pattern=PERIOD_PATTERN),
+) -> list[BatchItemResult]:
+    """Extracts the metrics from many files, of many companies, at once.
+
+    ``company_ids`` gives the company of each file, in the same order, an empty value
+    for none. Zip archives are expanded, and the documents in a folder of an archive
+    belong to the company the top folder is named after, e.g. ``acme/Q1.xlsx``. Every
+    document is processed concurrently. The successful extractions are stored as
+    drafts in a single write, the errors, like a file without a company, are reported
+    per file.
+
+    """
+    if company_ids is not None and len(company_ids) != len(files):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Got {len(company_ids)} company ids for {len(files)} files",
+        )
+    uploads: list[BatchDocument] = []
+    for idx, file in enumerate(files):
+        if file.filename is None:
+            raise HTTPException(status_code=400, detail="File name is required")
+        company_id = None if company_ids is None else company_ids[idx] or None
+        uploads.append(BatchDocument(file.filename, await file.read(), company_id))
+    try:
+        documents = expand_archives(uploads)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {str(e)}")
+    results = await parse_batch(documents, duplicate_index)
+    reports: list[Report] = []
+    for result in results:
+        if result.form_data is None:
+            continue
+        report = Report(
+            company_id=result.company_id,
+            period=period,
+            form_data=result.form_data,
+            state=SubmissionState.DRAFT,
+            fingerprint=result.fingerprint,
+        )
+        result.report_id = report.id
+        reports.append(report)
+    store.put_many(reports)
+    return results
+
+
+@app.post("/startup-report/mailbox")
+async def import_mailbox(
+    file: UploadFile = File(...),
+    period: Optional[str] = Query(default=None, pattern=PERIOD_PATTERN),
+) -> StreamingResponse:
+    """Extracts the metrics from the emails of an mbox file, of an ``.eml`` file or of
+    a zip archive of ``.eml`` files.
+
+    The body of each email and its spreadsheet and text attachments are extracted as
+    separate documents, and stored as drafts of the company of the sender, guessed
+    from the domain of their address. A near-duplicate of a document already stored
+    for the company reuses its metrics. The results are streamed as NDJSON, one line
+    per document, as soon as they are ready.
+
+    """
+    suffix = Path(file.filename or "").suffix
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as upload:
+        # Mailboxes can be large, so the upload is copied to disk in chunks
+        await asyncio.to_thread(shutil.copyfileobj, file.file, upload)
+    path = Path(upload.name)
+
+    async def lines() -> AsyncIterator[str]:
+        pending: list[Report] = []
+        try:
+            messages = iter_messages(path)
+            async for result in import_messages(messages, duplicate_index):
+                if result.form_data is not None:
+                    pending.append(
+                        Report(
+                            company_id=result.company_id,
+                            period=period,
+                            form_data=result.form_data,
+                            state=SubmissionState.DRAFT,
+                            fingerprint=result.fingerprint,
+                        )
+                    )
+                    if len(pending) >= MAIL_STORE_BATCH:
+                        store.put_many(pending)
+                        pending = []
+                yield result.model_dump_json() + "\n"
+        finally:
+            store.put_many(pending)
+            path.unlink(missing_ok=True)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0) -> Job:
+    """Returns an extraction job.
+
+    If ``wait`` is positive, the request is held for up to that many seconds until the
+    job finishes (long polling).
+
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    if wait > 0:
+        job = await job_queue.wait(job_id, min(wait, 60)) or job
+    return job
 
 
 @app.post("/startup-report/")
-async def uplod_draft(report: Report):
-    db.append(report)
+async def uplod_draft(report: Report) -> Report:
+    return store.put(report)
 
 
 @app.get("/startup-report")
-async def get_current_draft() -> Optional[FormData]:
-    try:
-        report = db[-1]
-        if report.state == SubmissionState.DRAFT:
-            return report.form_data
-        else:
-            return None
-    except IndexError:
+async def get_current_draft(company_id: Optional[str] = None) -> Optional[Report]:
+    """Returns the draft of a company, unless it has been finalized since.
+
+    Without a company, the last report overall is considered. The draft is updated in
+    place by uploading it again with its id.
+
+    """
+    report = store.latest(company_id)
+    if report is not None and report.state == SubmissionState.DRAFT:
+        return report
+    else:
         return None
+
+
+@app.get("/startup-reports")
+async def list_reports(
+    company_id: Optional[str] = None,
+    period: Optional[str] = Query(default=None, pattern=PERIOD_PATTERN),
+    state: Optional[SubmissionState] = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=500),
+) -> ReportPage:
+    """Returns the reports that match the filters, newest first, one page at a time."""
+    return store.query(company_id, period, state, offset, limit)
+
+
+@app.get("/startup-reports/export")
+async def export_reports(
+    file_format: ExportFormat = Query(default="csv", alias="format"),
+    company_id: Optional[str] = None,
+    period: Optional[str] = Query(default=None, pattern=PERIOD_PATTERN),
+    state: Optional[SubmissionState] = None,
+) -> StreamingResponse:
+    """Exports the reports that match the filters as CSV, XLSX or Parquet, newest
+    first.
+
+    The file is streamed while it's written, a chunk of reports at a time, so the
+    download starts right away and the memory use doesn't grow with the export.
+
+    """
+    return StreamingResponse(
+        EXPORTERS[file_format](store.iter_query(company_id, period, state)),
+        media_type=MEDIA_TYPES[file_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="reports.{file_format}"'
+        },
+    )
+
+
+@app.get("/startup-reports/{report_id}")
+async def get_report(report_id: str) -> Report:
+    report = store.get(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Unknown report '{report_id}'")
+    return report
+
+
+@app.get("/startup-reports/{report_id}/validation")
+async def get_report_validation(report_id: str) -> ReportValidation:
+    """Returns the inconsistencies, outliers and red flags found in a report."""
+    validation = validation_index.get(report_id)
+    if validation is None:
+        raise HTTPException(status_code=404, detail=f"Unknown report '{report_id}'")
+    return validation
+
+
+@app.get("/portfolio/aggregates")
+async def get_portfolio_aggregates(
+    metrics: list[str] = Query(default=["arr", "runway_months"]),
+    group_by: list[GroupBy] = Query(default=[]),
+    stats: list[Statistic] = Query(default=["median", "sum"]),
+) -> list[AggregateRow]:
+    """Aggregates the metrics of the finalized reports, optionally grouped by period,
+    sector, fund or company."""
+    unknown = set(metrics) - set(METRICS) - set(DERIVED_METRICS)
+    if len(unknown) > 0:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown metrics: {', '.join(sorted(unknown))}"
+        )
+    return portfolio.aggregate(metrics, group_by, stats)
+
+
+@app.get("/portfolio/validation")
+async def get_portfolio_validation(
+    company_id: Optional[str] = None,
+    period: Optional[str] = Query(default=None, pattern=PERIOD_PATTERN),
+    severity: list[Severity] = Query(default=[]),
+) -> list[ReportValidation]:
+    """Returns the reports with findings, e.g. ``severity=alert`` for the red flags
+    like a short runway."""
+    return validation_index.find(company_id, period, severity or None)
+
+
+@app.get("/portfolio/snapshot")
+async def get_portfolio_snapshot(
+    columns: list[str] = Query(default=[]),
+    file_format: SnapshotFormat = Query(default="arrow", alias="format"),
+) -> Response:
+    """Returns the finalized reports as an Arrow IPC stream or as Parquet, with only
+    the given columns, or all of them if none is given."""
+    unknown = set(columns) - set(COLUMNS)
+    if len(unknown) > 0:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown columns: {', '.join(sorted(unknown))}"
+        )
+    return Response(
+        content=serialize_table(snapshot.read(columns or None), file_format),
+        media_type=SNAPSHOT_MEDIA_TYPES[file_format],
+    )
+
+
+@app.get("/extraction-cache/stats")
+async def get_extraction_cache_stats() -> CacheStats:
+    return extraction_cache.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    """Exposes the monitoring metrics in the Prometheus text format."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
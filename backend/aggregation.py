@@ -0,0 +1,177 @@
+import threading
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from commons import FormData, SubmissionState
+
+from .db import Report
+
+METRICS: list[str] = list(FormData.model_fields)
+"""The numeric columns of the frame, one per `FormData` field."""
+
+DERIVED_METRICS: dict[str, tuple[str, str]] = {
+    "female_employees_ratio": ("number_of_female_employees", "number_of_employees"),
+    "female_c_level_ratio": (
+        "number_of_female_c_level_executives",
+        "number_of_c_level_executives",
+    ),
+    "female_board_ratio": (
+        "number_of_female_board_members",
+        "number_of_board_members",
+    ),
+}
+"""Ratios computed from pairs of columns, as ``(numerator, denominator)``."""
+
+GroupBy = Literal["period", "sector", "fund", "company_id"]
+GROUP_COLUMNS: tuple[GroupBy, ...] = ("period", "sector", "fund", "company_id")
+
+Statistic = Literal[
+    "count", "sum", "mean", "median", "min", "max", "p10", "p25", "p75", "p90"
+]
+_QUANTILES = {"p10": 0.1, "p25": 0.25, "p75": 0.75, "p90": 0.9}
+
+
+class AggregateRow(BaseModel):
+    """The aggregates of a group of finalized reports."""
+
+    group: dict[str, str | None]
+    """The values of the grouping columns that identify the group."""
+    reports: int
+    """The number of reports in the group."""
+    values: dict[str, dict[str, float | None]]
+    """Maps each metric to its statistics, e.g. ``values["arr"]["sum"]``."""
+
+
+class PortfolioFrame:
+    """Columnar view of the metrics of all the finalized reports.
+
+    The metrics are kept in a preallocated NumPy matrix with one row per report, which
+    is updated in place on every insert instead of being rebuilt from the `Report`
+    objects on each query. Missing values are stored as NaN.
+
+    """
+
+    def __init__(self, initial_capacity: int = 1024) -> None:
+        self._values = np.full((initial_capacity, len(METRICS)), np.nan)
+        self._groups = np.full(
+            (initial_capacity, len(GROUP_COLUMNS)), None, dtype=object
+        )
+        self._alive = np.zeros(initial_capacity, dtype=bool)
+        self._rows: dict[str, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._values)
+        values = np.full((capacity, len(METRICS)), np.nan)
+        values[: self._size] = self._values[: self._size]
+        groups = np.full((capacity, len(GROUP_COLUMNS)), None, dtype=object)
+        groups[: self._size] = self._groups[: self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self._size] = self._alive[: self._size]
+        self._values, self._groups, self._alive = values, groups, alive
+
+    def update(self, report: Report) -> None:
+        """Adds, replaces or removes the row of a report.
+
+        Only finalized reports are part of the frame: a report that goes back to being
+        a draft is removed.
+
+        """
+        with self._lock:
+            row = self._rows.get(report.id)
+            if report.state != SubmissionState.FINALIZED:
+                if row is not None:
+                    self._alive[row] = False
+                return
+            if row is None:
+                if self._size == len(self._values):
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._rows[report.id] = row
+            form_data = report.form_data
+            self._values[row] = [
+                np.nan if value is None else float(value)
+                for value in (getattr(form_data, metric) for metric in METRICS)
+            ]
+            self._groups[row] = [getattr(report, column) for column in GROUP_COLUMNS]
+            self._alive[row] = True
+
+    def frame(self) -> pd.DataFrame:
+        """Returns the metrics and the grouping columns of the finalized reports."""
+        with self._lock:
+            alive = self._alive[: self._size]
+            values = self._values[: self._size][alive]
+            groups = self._groups[: self._size][alive]
+        df = pd.DataFrame(values, columns=METRICS)
+        for column_idx, column in enumerate(GROUP_COLUMNS):
+            df[column] = groups[:, column_idx]
+        for name, (numerator, denominator) in DERIVED_METRICS.items():
+            df[name] = df[numerator] / df[denominator].where(df[denominator] != 0)
+        return df
+
+    def aggregate(
+        self,
+        metrics: list[str],
+        group_by: list[GroupBy],
+        statistics: list[Statistic],
+    ) -> list[AggregateRow]:
+        """Computes the statistics of the metrics for each group of reports.
+
+        NaNs, i.e. missing values, are ignored by every statistic.
+
+        """
+        df = self.frame()
+        if len(df) == 0:
+            return []
+        keys: list[str] = list(group_by)
+        if len(keys) == 0:
+            df["_all"] = ""
+            keys = ["_all"]
+        # Missing group values would be dropped by `groupby`, so they are made explicit
+        df[keys] = df[keys].astype(object).where(df[keys].notna(), "")
+        groups = df.groupby(keys, sort=True, as_index=True)
+        grouped = groups[metrics]
+
+        results: dict[str, pd.DataFrame] = {}
+        for statistic in statistics:
+            if statistic in _QUANTILES:
+                results[statistic] = grouped.quantile(_QUANTILES[statistic])
+            elif statistic == "sum":
+                # Otherwise a group without any value would sum to 0
+                results[statistic] = grouped.sum(min_count=1)
+            else:
+                results[statistic] = grouped.agg(statistic)
+        sizes = groups.size()
+
+        rows: list[AggregateRow] = []
+        for group_key, size in sizes.items():
+            key_values = group_key if isinstance(group_key, tuple) else (group_key,)
+            rows.append(
+                AggregateRow(
+                    group={
+                        column: (value if value != "" else None)
+                        for column, value in zip(group_by, key_values)
+                    },
+                    reports=int(size),
+                    values={
+                        metric: {
+                            statistic: _to_optional_float(
+                                results[statistic].at[group_key, metric]
+                            )
+                            for statistic in statistics
+                        }
+                        for metric in metrics
+                    },
+                )
+            )
+        return rows
+
+
+def _to_optional_float(value: object) -> float | None:
+    number = float(value)  # type: ignore[arg-type]
+    return None if np.isnan(number) else number
@@ -0,0 +1,126 @@
+import asyncio
+import io
+import os
+import zipfile
+from pathlib import PurePosixPath
+from typing import NamedTuple
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from commons import FormData
+
+from .dedup import DuplicateIndex, fingerprint
+from .file_to_metrics import extract_metrics_async, file_to_text_async
+from .monitoring import count_failure
+from .prompt import load_prompt_template
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+"""Maximum number of documents of a batch that are processed at the same time."""
+
+
+class BatchDocument(NamedTuple):
+    file_name: str
+    file_bytes: bytes
+    company_id: str | None
+
+
+class BatchItemResult(BaseModel):
+    """The outcome of the extraction of a single document of a batch."""
+
+    file_name: str
+    company_id: str | None = None
+    report_id: str | None = None
+    """The id of the draft the metrics were stored as."""
+    form_data: FormData | None = None
+    duplicate_of: str | None = None
+    """The stored report whose metrics were reused, if the document is a
+    near-duplicate of the one it was extracted from."""
+    error: str | None = None
+    fingerprint: str | None = Field(default=None, exclude=True)
+    """The fingerprint of the document, stored with its report."""
+
+
+def expand_archives(files: list[BatchDocument]) -> list[BatchDocument]:
+    """Replaces the zip archives in a list of uploaded files with the documents that
+    they contain.
+
+    A document in a folder of an archive belongs to the company the top folder is
+    named after, otherwise to the company of the archive. Directories and hidden
+    files, like the ``__MACOSX`` metadata, are skipped.
+
+    """
+    documents: list[BatchDocument] = []
+    for file_name, file_bytes, company_id in files:
+        if not file_name.lower().endswith(".zip"):
+            documents.append(BatchDocument(file_name, file_bytes, company_id))
+            continue
+        with zipfile.ZipFile(io.BytesIO(file_bytes)) as archive:
+            for info in archive.infolist():
+                path = PurePosixPath(info.filename)
+                if info.is_dir() or any(
+                    part.startswith((".", "__")) for part in path.parts
+                ):
+                    continue
+                documents.append(
+                    BatchDocument(
+                        f"{file_name}/{info.filename}",
+                        archive.read(info),
+                        path.parts[0] if len(path.parts) > 1 else company_id,
+                    )
+                )
+    return documents
+
+
+async def parse_batch(
+    documents: list[BatchDocument], duplicates: DuplicateIndex | None = None
+) -> list[BatchItemResult]:
+    """Extracts the metrics of many documents concurrently.
+
+    At most `BATCH_MAX_CONCURRENCY` documents are in flight, so the whole batch takes
+    about as long as its slowest extractions. A failing document, or one without a
+    company, doesn't affect the others: its error is reported in its result. A
+    near-duplicate of a document already stored for the company in ``duplicates``
+    reuses its metrics instead of being extracted again.
+
+    """
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def parse_one(document: BatchDocument) -> BatchItemResult:
+        result = BatchItemResult(
+            file_name=document.file_name, company_id=document.company_id
+        )
+        if document.company_id is None:
+            result.error = (
+                "No company for the file: give one in `company_ids`, or put the file "
+                "in a folder named after the company in the zip archive."
+            )
+            return result
+        async with semaphore:
+            try:
+                content_text = await file_to_text_async(
+                    document.file_name, document.file_bytes
+                )
+                document_fingerprint = fingerprint(content_text)
+                duplicate = None
+                if duplicates is not None and document_fingerprint is not None:
+                    duplicate = duplicates.find(
+                        document.company_id, document_fingerprint
+                    )
+                if duplicate is None:
+                    result.form_data = await extract_metrics_async(
+                        content_text, load_prompt_template()
+                    )
+                else:
+                    result.form_data = duplicate.form_data
+                    result.duplicate_of = duplicate.id
+            except Exception as e:
+                count_failure(e)
+                logger.warning(f"Couldn't parse '{document.file_name}': {e}")
+                result.error = str(e)
+                return result
+        if document_fingerprint is not None:
+            result.fingerprint = str(document_fingerprint)
+        return result
+
+    return await asyncio.gather(*(parse_one(document) for document in documents))
@@ -0,0 +1,199 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+from loguru import logger
+from pydantic import BaseModel
+
+from commons import FormData
+
+
+class CacheStats(BaseModel):
+    """Counters that describe the effectiveness of the extraction cache."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    memory_entries: int = 0
+    disk_entries: int = 0
+    disk_bytes: int = 0
+
+
+def normalize_document(content: str) -> str:
+    """Normalizes a document so that trivially different uploads share a cache key.
+
+    Line endings, trailing whitespace, runs of blank lines and the Unicode
+    representation of the text are normalized.
+
+    """
+    text = unicodedata.normalize("NFC", content)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines: list[str] = []
+    for line in text.split("\n"):
+        line = line.rstrip()
+        if line == "" and (len(lines) == 0 or lines[-1] == ""):
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+@functools.cache
+def _schema_digest(schema: type[BaseModel]) -> str:
+    text = json.dumps(schema.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(
+    content: str, template: str, model: str, schema: type[BaseModel] = FormData
+) -> str:
+    """Computes the content address of an extraction.
+
+    The key depends on the normalized document, the prompt template, the schema the
+    prompt is compiled with and the model, so changing any of them, e.g. the
+    description of a field, invalidates the cached results.
+
+    """
+    payload = json.dumps(
+        [normalize_document(content), template, _schema_digest(schema), model]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Two-tier cache of validated extraction results.
+
+    The first tier is an in-memory LRU, the second one is a directory of JSON files
+    that survives restarts. Disk entries expire after ``ttl_seconds`` and the least
+    recently used ones are evicted as soon as the directory grows beyond
+    ``max_disk_bytes``.
+
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_memory_entries: int = 256,
+        max_disk_bytes: int = 100 * 1024 * 1024,
+        ttl_seconds: float = 30 * 24 * 3600,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory: OrderedDict[str, FormData] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._disk_bytes = sum(path.stat().st_size for path in self._disk_entries())
+
+    @classmethod
+    def from_env(cls) -> "ExtractionCache":
+        """Builds the cache from the ``EXTRACTION_CACHE_*`` environment variables."""
+        return cls(
+            cache_dir=Path(os.getenv("EXTRACTION_CACHE_DIR", ".extraction_cache")),
+            max_memory_entries=int(os.getenv("EXTRACTION_CACHE_MEMORY_ENTRIES", "256")),
+            max_disk_bytes=int(float(os.getenv("EXTRACTION_CACHE_MAX_DISK_MB", "100")))
+            * 1024
+            * 1024,
+            ttl_seconds=float(os.getenv("EXTRACTION_CACHE_TTL_DAYS", "30")) * 24 * 3600,
+        )
+
+    def _disk_entries(self) -> list[Path]:
+        return list(self.cache_dir.glob("*.json"))
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _remember(self, key: str, form_data: FormData) -> None:
+        self._memory[key] = form_data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _remove_disk_entry(self, path: Path) -> None:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        self._disk_bytes -= size
+
+    def get(self, key: str) -> FormData | None:
+        """Returns the cached result for ``key``, if there is one."""
+        with self._lock:
+            form_data = self._memory.get(key)
+            if form_data is not None:
+                self._memory.move_to_end(key)
+                self._stats.memory_hits += 1
+                return form_data.model_copy()
+
+            path = self._disk_path(key)
+            try:
+                mtime = path.stat().st_mtime
+                if time.time() - mtime > self.ttl_seconds:
+                    self._remove_disk_entry(path)
+                    raise FileNotFoundError(path)
+                form_data = FormData.model_validate_json(path.read_bytes())
+            except FileNotFoundError:
+                self._stats.misses += 1
+                return None
+            except ValueError:
+                logger.warning(f"Discarding the corrupted cache entry '{path}'.")
+                self._remove_disk_entry(path)
+                self._stats.misses += 1
+                return None
+            # Touch the file so that the disk tier evicts in LRU order
+            os.utime(path)
+            self._remember(key, form_data)
+            self._stats.disk_hits += 1
+            return form_data.model_copy()
+
+    def put(self, key: str, form_data: FormData) -> None:
+        """Stores ``form_data`` in both tiers."""
+        with self._lock:
+            self._remember(key, form_data.model_copy())
+            path = self._disk_path(key)
+            self._remove_disk_entry(path)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(form_data.model_dump_json(), encoding="utf-8")
+            tmp_path.replace(path)
+            self._disk_bytes += path.stat().st_size
+            self._evict()
+
+    def _evict(self) -> None:
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        entries = sorted(self._disk_entries(), key=lambda path: path.stat().st_mtime)
+        now = time.time()
+        for path in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            self._remove_disk_entry(path)
+        # Expired entries are dropped as well while we're at it
+        for path in entries:
+            if path.exists() and now - path.stat().st_mtime > self.ttl_seconds:
+                self._remove_disk_entry(path)
+
+    def clear(self) -> None:
+        """Empties both tiers."""
+        with self._lock:
+            self._memory.clear()
+            for path in self._disk_entries():
+                self._remove_disk_entry(path)
+
+    def stats(self) -> CacheStats:
+        """Returns a snapshot of the hit/miss counters and of the cache size."""
+        with self._lock:
+            return self._stats.model_copy(
+                update={
+                    "memory_entries": len(self._memory),
+                    "disk_entries": len(self._disk_entries()),
+                    "disk_bytes": self._disk_bytes,
+                }
+            )
@@ -0,0 +1,97 @@
+import os
+from collections import Counter
+from typing import Any
+
+from .compaction import estimate_tokens, split_segments
+from .synonyms import FIELD_SYNONYMS, normalize_label
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "4000"))
+"""Documents longer than this are extracted in chunks of about this many tokens.
+Non-positive values disable the chunking."""
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "200"))
+"""How many tokens at the end of a chunk are repeated at the start of the next one, so
+that a value isn't separated from its label."""
+
+
+def split_into_chunks(
+    content: str,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> list[str]:
+    """Splits a document in overlapping chunks along lines and sentences.
+
+    Short documents are returned as a single chunk.
+
+    """
+    if chunk_tokens <= 0 or estimate_tokens(content) <= chunk_tokens:
+        return [content]
+    chunks: list[str] = []
+    current: list[tuple[str, int]] = []
+    current_tokens = 0
+    for segment in split_segments(content):
+        segment_tokens = estimate_tokens(segment)
+        if current_tokens + segment_tokens > chunk_tokens and len(current) > 0:
+            chunks.append("\n".join(text for text, _ in current))
+            # Carry the tail of the chunk over to the next one
+            overlap: list[tuple[str, int]] = []
+            overlap_size = 0
+            for text, tokens in reversed(current):
+                if overlap_size + tokens > overlap_tokens:
+                    break
+                overlap.insert(0, (text, tokens))
+                overlap_size += tokens
+            current, current_tokens = overlap, overlap_size
+        current.append((segment, segment_tokens))
+        current_tokens += segment_tokens
+    chunks.append("\n".join(text for text, _ in current))
+    return chunks
+
+
+def _specificity(chunk: str, field_name: str) -> int:
+    """Rates how specifically a chunk refers to a field.
+
+    This is the length of the longest synonym of the field that appears in the chunk,
+    so that "EBITDA (LTM)" beats a bare "EBITDA", or 0 if none does.
+
+    """
+    text = normalize_label(chunk)
+    return max(
+        (len(synonym) for synonym in FIELD_SYNONYMS[field_name] if synonym in text),
+        default=0,
+    )
+
+
+def merge_chunk_results(
+    chunks: list[str], results: list[dict[str, Any]]
+) -> dict[str, Any]:
+    """Merges the fields extracted from each chunk of a document.
+
+    When the chunks disagree on a field, the value from the chunk that names the field
+    most specifically wins, then the value extracted from most chunks, then the one
+    from the earliest chunk. This doesn't depend on the order in which the extractions
+    complete.
+
+    """
+    merged: dict[str, Any] = {}
+    fields = {field_name for result in results for field_name in result}
+    for field_name in sorted(fields):
+        candidates = [
+            (chunk_idx, result[field_name])
+            for chunk_idx, result in enumerate(results)
+            if result.get(field_name) is not None
+        ]
+        if len(candidates) == 0:
+            continue
+        votes = Counter(value for _, value in candidates)
+        _, value = max(
+            candidates,
+            key=lambda candidate: (
+                _specificity(chunks[candidate[0]], field_name)
+                if field_name in FIELD_SYNONYMS
+                else 0,
+                votes[candidate[1]],
+                -candidate[0],
+            ),
+        )
+        merged[field_name] = value
+    return merged
@@ -0,0 +1,230 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterable
+
+from commons import FormData
+
+from .synonyms import FIELD_SYNONYMS, normalize_label
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+"""Maximum number of document tokens sent to the LLM. Non-positive values disable the
+compaction."""
+
+_PROSE_KEYWORDS: dict[str, tuple[str, ...]] = {
+    "revenue": ("revenue", "ingresos", "facturacion", "sales", "ventas"),
+    "number_of_employees": ("team", "people", "equipo", "personas"),
+    "number_of_female_employees": ("women", "female", "mujeres"),
+    "number_of_c_level_executives": ("executive", "comite", "ejecutivo", "direccion"),
+    "number_of_female_c_level_executives": ("women", "female", "mujeres"),
+    "number_of_board_members": ("board", "consejo"),
+    "number_of_female_board_members": ("women", "female", "mujeres"),
+    "monthly_burn": ("cash", "caja"),
+    "runway_months": ("cash", "caja"),
+    "total_assets": ("assets", "activos"),
+}
+"""Words that hint at a field in running text, on top of the labels of its synonyms."""
+
+_STOPWORDS = frozenset(
+    ("the", "and", "of", "on", "per", "de", "del", "el", "la", "en", "y", "sobre")
+    + ("total", "number", "numero", "months", "meses", "ltm", "last", "ultimos")
+)
+_STEM_LENGTH = 5
+"""Words are compared by prefix, so that "cliente" and "clientes" match."""
+
+_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+_WORD_PATTERN = re.compile(r"[^\W\d_]+|\d[\d.,]*")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[^\W\d_])")
+_UNIT_PATTERN = re.compile(
+    r"\b(?:thousands?|millions?|miles|millones|figures|amounts|cifras|importes"
+    r"|currency|moneda|expressed|expresad[oa]s?)\b"
+)
+"""Words that state the unit or the currency of the figures of a document, like in
+"figures in EUR thousands" or "cifras en miles de €"."""
+_NUMBER_PATTERN = re.compile(r"\d[\d.,]*")
+_CONTEXT_BUDGET_SHARE = 0.2
+"""The share of the token budget that the context lines can take at most."""
+_PERIOD_PATTERN = re.compile(r"\b(?:q[1-4]|h[12]|fy)?\s*'?(?:19|20)?\d{2}\b")
+_PROXIMITY_WINDOW = 8
+"""How many words a number and a keyword can be apart to be considered related."""
+_MAX_LABEL_WORDS = 6
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens in a text.
+
+    Words are counted in chunks of four characters, which is close enough to the BPE
+    tokenizers of the OpenAI models and doesn't require downloading their vocabularies.
+
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+@dataclass
+class CompactedDocument:
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+
+def _stem(word: str) -> str:
+    return word[:_STEM_LENGTH]
+
+
+def _field_keywords(fields: Iterable[str]) -> frozenset[str]:
+    keywords: set[str] = set()
+    for field_name in fields:
+        labels = FIELD_SYNONYMS.get(field_name, ()) + _PROSE_KEYWORDS.get(
+            field_name, ()
+        )
+        for label in labels:
+            for word in re.findall(r"[a-z]+", label):
+                if word not in _STOPWORDS and len(word) >= 3:
+                    keywords.add(_stem(word))
+    return frozenset(keywords)
+
+
+def split_segments(content: str) -> list[str]:
+    """Splits a document in lines, and long lines of prose in sentences."""
+    segments: list[str] = []
+    for line in content.splitlines():
+        line = line.strip()
+        if line != "":
+            segments.extend(_SENTENCE_END.split(line))
+    return segments
+
+
+def _is_context(segment: str) -> bool:
+    """Tells whether a segment gives the context needed to read the figures of the
+    others, i.e. states their unit or currency, or is a header made only of periods,
+    like "Metric, Q4 2024, Q1 2025".
+
+    A line with a currency amount doesn't state the unit of the document, so a unit
+    statement must have a unit word and at most one number.
+
+    """
+    normalized = normalize_label(segment)
+    if _UNIT_PATTERN.search(normalized):
+        return len(_NUMBER_PATTERN.findall(normalized)) <= 1
+    without_periods = _PERIOD_PATTERN.sub("", normalized)
+    return without_periods != normalized and not any(
+        character.isdigit() for character in without_periods
+    )
+
+
+def _score(segment: str, keywords: frozenset[str]) -> tuple[float, bool]:
+    """Scores how likely a segment is to state one of the metrics.
+
+    Each number contributes more the closer it is to a keyword, while numbers that
+    aren't close to any keyword still count a little, since they may be labeled by a
+    neighbouring line. The second returned value tells whether the segment contains
+    keywords.
+
+    """
+    words = _WORD_PATTERN.findall(normalize_label(segment))
+    number_positions = [idx for idx, word in enumerate(words) if word[0].isdigit()]
+    keyword_positions = [
+        idx
+        for idx, word in enumerate(words)
+        if not word[0].isdigit() and _stem(word) in keywords
+    ]
+    score = 0.0
+    for number_idx in number_positions:
+        distance = min(
+            (abs(number_idx - keyword_idx) for keyword_idx in keyword_positions),
+            default=None,
+        )
+        if distance is None or distance > _PROXIMITY_WINDOW:
+            score += 0.1
+        else:
+            score += 1 / distance
+    return score, len(keyword_positions) > 0
+
+
+def compact_document(
+    content: str,
+    fields: Iterable[str] | None = None,
+    token_budget: int = PROMPT_TOKEN_BUDGET,
+) -> CompactedDocument:
+    """Keeps only the parts of a document that are relevant to the given fields.
+
+    The document is split in lines and sentences, which are scored by how many numbers
+    they contain and how close those are to the synonyms of the fields. Segments
+    without numbers are dropped, except for labels directly followed by a number and
+    for the lines stating the unit or the currency of the figures, or the periods of
+    their columns, which are kept first up to `_CONTEXT_BUDGET_SHARE` of the budget.
+    The best segments are then kept, in their original order, until ``token_budget``
+    is reached. All the `FormData` fields are considered unless ``fields`` is given.
+
+    A document that already fits in the budget is returned unchanged.
+
+    """
+    tokens_before = estimate_tokens(content)
+    if token_budget <= 0 or tokens_before <= token_budget:
+        return CompactedDocument(content, tokens_before, tokens_before)
+    keywords = _field_keywords(FormData.model_fields if fields is None else fields)
+    segments = split_segments(content)
+    scored = [_score(segment, keywords) for segment in segments]
+    scores = [score for score, _ in scored]
+    for idx, (score, has_keywords) in enumerate(scored[:-1]):
+        # A label on its own line, e.g. "ARR:", followed by its value
+        is_label = len(segments[idx].split()) <= _MAX_LABEL_WORDS
+        if score == 0 and has_keywords and is_label and scored[idx + 1][0] > 0:
+            scores[idx] = scored[idx + 1][0]
+
+    segment_tokens = [estimate_tokens(segment) for segment in segments]
+    kept: list[int] = []
+    tokens_after = 0
+    context_budget = int(token_budget * _CONTEXT_BUDGET_SHARE)
+    for idx, segment in enumerate(segments):
+        if (
+            _is_context(segment)
+            and tokens_after + segment_tokens[idx] <= context_budget
+        ):
+            kept.append(idx)
+            tokens_after += segment_tokens[idx]
+    context = set(kept)
+    # The rest of the budget is filled with the segments with the most relevance per
+    # token first
+    ranking = sorted(
+        (idx for idx in range(len(segments)) if scores[idx] > 0 and idx not in context),
+        key=lambda idx: scores[idx] / max(segment_tokens[idx], 1),
+        reverse=True,
+    )
+    for idx in ranking:
+        if tokens_after + segment_tokens[idx] > token_budget:
+            continue
+        kept.append(idx)
+        tokens_after += segment_tokens[idx]
+    text = "\n".join(segments[idx] for idx in sorted(kept))
+    return CompactedDocument(text, tokens_before, estimate_tokens(text))
+
+
+def _synonym_pattern(field_name: str) -> re.Pattern[str]:
+    synonyms = sorted(FIELD_SYNONYMS.get(field_name, ()), key=len, reverse=True)
+    if len(synonyms) == 0:
+        return re.compile(r"(?!)")
+    return re.compile(r"\b(?:" + "|".join(map(re.escape, synonyms)) + r")(?!\w)")
+
+
+def mentioned_fields(content: str, fields: Iterable[str]) -> list[str]:
+    """Returns the fields that a document seems to state, i.e. whose synonyms appear
+    on a line with a number, or on a label line directly followed by a number."""
+    segments = [normalize_label(segment) for segment in split_segments(content)]
+    has_number = [re.search(r"\d", segment) is not None for segment in segments]
+    # A label is checked together with the line that follows it
+    windows = [
+        segment
+        for idx, segment in enumerate(segments)
+        if has_number[idx]
+        or (
+            len(segment.split()) <= _MAX_LABEL_WORDS
+            and idx + 1 < len(segments)
+            and has_number[idx + 1]
+        )
+    ]
+    return [
+        field_name
+        for field_name in fields
+        if any(_synonym_pattern(field_name).search(window) for window in windows)
+    ]
@@ -1,16 +1,60 @@
 import json
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Hashable, Iterable, Iterator
 
-from pydantic import BaseModel
+from loguru import logger
+from pydantic import BaseModel, Field
 
 from commons import FormData, SubmissionState
 
 
+PERIOD_PATTERN = r"^\d{4}-Q[1-4]$"
+"""The format of the reporting periods, e.g. ``2025-Q1``."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Report(BaseModel):
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    """Identifies the report. Storing a report with an existing id replaces it."""
+    company_id: str | None = None
+    """The company the metrics refer to."""
+    period: str | None = Field(default=None, pattern=PERIOD_PATTERN)
+    """The reporting period, e.g. ``2025-Q1``."""
+    sector: str | None = None
+    fund: str | None = None
+    """The fund that holds the company."""
     form_data: FormData
     state: SubmissionState
+    fingerprint: str | None = None
+    """The fingerprint of the document the metrics were extracted from, used to
+    recognize documents that are sent again."""
+    created_at: datetime = Field(default_factory=_now)
+    updated_at: datetime = Field(default_factory=_now)
+
+
+class ReportPage(BaseModel):
+    """A page of the results of a query, newest reports first."""
+
+    total: int
+    """The number of reports that match the query."""
+    offset: int
+    items: list[Report]
 
 
 DB_FILE_PATH = "db.json"
+"""Where the reports were stored before the journal was introduced.
+
+The file is imported the first time the store is opened, if it exists.
+
+"""
 
 
 def load_db() -> list[Report]:
@@ -22,7 +66,307 @@ def load_db() -> list[Report]:
     return [Report.parse_obj(item) for item in parsed_json]
 
 
-def save_db(db: list[Report]) -> None:
-    dicts = [item.model_dump() for item in db]
-    with open(DB_FILE_PATH, "w") as file:
-        json.dump(dicts, file)
+class ReportStore:
+    """Durable storage engine for the reports, based on an append-only journal.
+
+    Every write appends one JSON line per report to ``journal.jsonl`` and fsyncs it, so
+    it costs O(1) regardless of how many reports are stored and survives crashes.
+    Every ``compact_every`` writes, the whole store is written to ``snapshot.jsonl`` and
+    the journal is truncated, which bounds the replay time on startup.
+
+    """
+
+    def __init__(self, data_dir: Path, compact_every: int = 1000) -> None:
+        self.data_dir = data_dir
+        self.compact_every = compact_every
+        self._reports: dict[str, Report] = {}
+        self._indexes: defaultdict[Hashable, dict[str, None]] = defaultdict(dict)
+        """Maps each indexed key to the ids of the matching reports.
+
+        The ids are stored as the keys of a dict, which behaves like an ordered set.
+
+        """
+        self._listeners: list[Callable[[Report], None]] = []
+        self._journal_entries = 0
+        self._journal: "_JournalFile | None" = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls) -> "ReportStore":
+        """Builds the store from the ``DB_DIR`` and ``DB_COMPACT_EVERY`` environment
+        variables."""
+        return cls(
+            data_dir=Path(os.getenv("DB_DIR", "db")),
+            compact_every=int(os.getenv("DB_COMPACT_EVERY", "1000")),
+        )
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.data_dir / "snapshot.jsonl"
+
+    @property
+    def journal_path(self) -> Path:
+        return self.data_dir / "journal.jsonl"
+
+    def open(self) -> None:
+        """Loads the snapshot, replays the journal and opens it for appending."""
+        with self._lock:
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+            self._reports.clear()
+            self._indexes.clear()
+            snapshot, _ = _read_jsonl(self.snapshot_path)
+            journal, torn = _read_jsonl(self.journal_path)
+            for report in snapshot + journal:
+                self._index(report)
+            self._journal_entries = len(journal)
+            migrate = (
+                len(self._reports) == 0
+                and not self.snapshot_path.exists()
+                and os.path.exists(DB_FILE_PATH)
+            )
+            if migrate:
+                for report in load_db():
+                    self._index(report)
+                logger.info(
+                    f"Imported {len(self._reports)} reports from '{DB_FILE_PATH}'."
+                )
+                self.compact()
+            elif torn:
+                # Get rid of the torn line before appending after it
+                self.compact()
+            self._journal = _JournalFile(self.journal_path)
+            logger.info(f"Loaded {len(self._reports)} reports.")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    @staticmethod
+    def _index_keys(report: Report) -> list[Hashable]:
+        return [
+            ("company", report.company_id),
+            ("period", report.period),
+            ("state", report.state),
+            ("company_state", report.company_id, report.state),
+            ("period_state", report.period, report.state),
+        ]
+
+    def _index(self, report: Report) -> None:
+        """Adds a report to the in-memory store, replacing the one with the same id."""
+        previous = self._reports.pop(report.id, None)
+        if previous is not None:
+            for key in self._index_keys(previous):
+                del self._indexes[key][previous.id]
+        self._reports[report.id] = report
+        for key in self._index_keys(report):
+            self._indexes[key][report.id] = None
+        for listener in self._listeners:
+            listener(report)
+
+    def subscribe(self, listener: Callable[[Report], None]) -> None:
+        """Registers a function that is called with every report that is stored.
+
+        This includes the reports loaded when the store is opened, so derived data
+        structures can be kept up to date incrementally.
+
+        """
+        self._listeners.append(listener)
+
+    def put(self, report: Report) -> Report:
+        """Durably stores a report, replacing the one with the same id if any."""
+        return self.put_many([report])[0]
+
+    def put_many(self, reports: Iterable[Report]) -> list[Report]:
+        """Durably stores many reports with a single fsync.
+
+        Reports that replace existing ones keep their creation time and get a new
+        update time. The stored reports are returned.
+
+        """
+        reports = list(reports)
+        if len(reports) == 0:
+            return reports
+        with self._lock:
+            if self._journal is None:
+                raise RuntimeError("The report store isn't open.")
+            now = _now()
+            for report_idx, report in enumerate(reports):
+                previous = self._reports.get(report.id)
+                if previous is not None:
+                    reports[report_idx] = report.model_copy(
+                        update={"created_at": previous.created_at, "updated_at": now}
+                    )
+            self._journal.write([report.model_dump_json() for report in reports])
+            for report in reports:
+                self._index(report)
+            self._journal_entries += len(reports)
+            if self._journal_entries >= self.compact_every:
+                self.compact()
+            return reports
+
+    def compact(self) -> None:
+        """Writes a snapshot of the whole store and truncates the journal."""
+        with self._lock:
+            tmp_path = self.snapshot_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                for report in self._reports.values():
+                    file.write(report.model_dump_json())
+                    file.write("\n")
+                file.flush()
+                os.fsync(file.fileno())
+            tmp_path.replace(self.snapshot_path)
+            if self._journal is not None:
+                self._journal.truncate()
+            else:
+                self.journal_path.write_bytes(b"")
+            self._journal_entries = 0
+
+    def get(self, report_id: str) -> Report | None:
+        return self._reports.get(report_id)
+
+    def latest(
+        self, company_id: str | None = None, state: SubmissionState | None = None
+    ) -> Report | None:
+        """Returns the last report stored for a company in a given state, in O(1).
+
+        Without arguments, the last report stored overall is returned.
+
+        """
+        with self._lock:
+            if state is not None:
+                ids: dict[str, None] | dict[str, Report] = self._indexes.get(
+                    ("company_state", company_id, state), {}
+                )
+            elif company_id is not None:
+                ids = self._indexes.get(("company", company_id), {})
+            else:
+                ids = self._reports
+            report_id = next(reversed(ids), None)
+            return None if report_id is None else self._reports[report_id]
+
+    def _matching_ids(
+        self,
+        company_id: str | None,
+        period: str | None,
+        state: SubmissionState | None,
+    ) -> list[str]:
+        """Returns the ids of the reports that match all the given filters, newest
+        first.
+
+        The lookup starts from the smallest index that covers one of the filters, so
+        its cost doesn't depend on the total number of reports.
+
+        """
+        candidates: list[dict[str, None]] = []
+        if company_id is not None and state is not None:
+            candidates.append(
+                self._indexes.get(("company_state", company_id, state), {})
+            )
+        elif company_id is not None:
+            candidates.append(self._indexes.get(("company", company_id), {}))
+        if period is not None and state is not None:
+            candidates.append(self._indexes.get(("period_state", period, state), {}))
+        elif period is not None:
+            candidates.append(self._indexes.get(("period", period), {}))
+        if state is not None and len(candidates) == 0:
+            candidates.append(self._indexes.get(("state", state), {}))
+
+        if len(candidates) == 0:
+            return list(reversed(self._reports))
+        candidates.sort(key=len)
+        smallest, others = candidates[0], candidates[1:]
+        return [
+            report_id
+            for report_id in reversed(smallest)
+            if all(report_id in other for other in others)
+        ]
+
+    def query(
+        self,
+        company_id: str | None = None,
+        period: str | None = None,
+        state: SubmissionState | None = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> ReportPage:
+        """Returns the reports that match all the given filters, newest first."""
+        with self._lock:
+            ids = self._matching_ids(company_id, period, state)
+            items = [
+                self._reports[report_id] for report_id in ids[offset : offset + limit]
+            ]
+            return ReportPage(total=len(ids), offset=offset, items=items)
+
+    def iter_query(
+        self,
+        company_id: str | None = None,
+        period: str | None = None,
+        state: SubmissionState | None = None,
+    ) -> Iterator[Report]:
+        """Yields all the reports that match the filters, newest first, without
+        holding the lock in between.
+
+        The matching ids are taken when the iteration starts. A report replaced in the
+        meantime is yielded in its latest version.
+
+        """
+        with self._lock:
+            ids = self._matching_ids(company_id, period, state)
+        for report_id in ids:
+            report = self._reports.get(report_id)
+            if report is not None:
+                yield report
+
+    def __len__(self) -> int:
+        return len(self._reports)
+
+    def __iter__(self) -> Iterator[Report]:
+        with self._lock:
+            return iter(list(self._reports.values()))
+
+
+class _JournalFile:
+    """An append-only file whose writes are fsynced before returning."""
+
+    def __init__(self, path: Path) -> None:
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, lines: list[str]) -> None:
+        self._file.write("".join(line + "\n" for line in lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def truncate(self) -> None:
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _read_jsonl(path: Path) -> tuple[list[Report], bool]:
+    """Reads the reports stored in a JSON lines file.
+
+    An incomplete last line, left by a crash in the middle of a write, is skipped. The
+    second returned value tells whether that happened.
+
+    """
+    reports: list[Report] = []
+    if not path.exists():
+        return reports, False
+    with open(path, "rb") as file:
+        for line in file:
+            if line.strip() == b"":
+                continue
+            try:
+                reports.append(Report.model_validate_json(line))
+            except ValueError:
+                if line.endswith(b"\n"):
+                    raise
+                logger.warning(f"Skipping the incomplete last entry of '{path}'.")
+                return reports, True
+    return reports, False
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import re
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from .cache import normalize_document
+from .db import Report
+
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", "6"))
+"""How many bits two SimHashes can differ by for their documents to be considered
+near-duplicates. At most 7, the number of bands of the index minus one."""
+
+_SHINGLE_WORDS = 3
+_BANDS = 8
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_WORD_PATTERN = re.compile(r"\w+")
+_NUMBER_PATTERN = re.compile(r"\d(?:[\d.,]*\d)?")
+
+
+class Fingerprint(NamedTuple):
+    """Identifies a document up to small edits."""
+
+    simhash: int
+    """The SimHash of the word shingles, which differs in few bits between documents
+    that differ in few words."""
+    numbers: int
+    """A hash of the numbers in the document, regardless of their order."""
+
+    def __str__(self) -> str:
+        return f"{self.simhash:016x}:{self.numbers:016x}"
+
+    @classmethod
+    def parse(cls, text: str) -> "Fingerprint":
+        simhash, numbers = text.split(":")
+        return cls(int(simhash, 16), int(numbers, 16))
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest())
+
+
+def fingerprint(content: str) -> Fingerprint | None:
+    """Computes the fingerprint of a document, `None` if it has no words."""
+    text = normalize_document(content).lower()
+    words = _WORD_PATTERN.findall(text)
+    if len(words) == 0:
+        return None
+    shingles = {
+        " ".join(words[idx : idx + _SHINGLE_WORDS])
+        for idx in range(max(len(words) - _SHINGLE_WORDS + 1, 1))
+    }
+    hashes = np.array([_hash64(shingle) for shingle in shingles], dtype=">u8")
+    # Each bit of the SimHash is set if most shingle hashes have it set
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1)
+    majority = (2 * bits.sum(axis=0, dtype=np.int64) > len(shingles)).astype(np.uint8)
+    simhash = int.from_bytes(np.packbits(majority).tobytes())
+    numbers = _hash64(" ".join(sorted(_NUMBER_PATTERN.findall(text))))
+    return Fingerprint(simhash, numbers)
+
+
+class DuplicateIndex:
+    """Finds the reports of a company extracted from a near-identical document.
+
+    The SimHashes are split in 8 bands of 8 bits: two hashes within 7 bits of each
+    other share at least one band, so a lookup only compares the reports of the
+    company that share a band with the document, instead of all of them. The index is
+    kept up to date as a listener of the `ReportStore`.
+
+    """
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE) -> None:
+        if not 0 <= max_distance < _BANDS:
+            raise ValueError(f"The maximum distance must be in [0, {_BANDS - 1}].")
+        self.max_distance = max_distance
+        self._bands: dict[tuple[str, int, int], dict[str, None]] = {}
+        self._entries: dict[str, tuple[str, Fingerprint, int]] = {}
+        """Maps the ids of the indexed reports to their company, their fingerprint and
+        the order in which they were indexed."""
+        self._reports: dict[str, Report] = {}
+        self._next_seq = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _band_keys(company_id: str, simhash: int) -> list[tuple[str, int, int]]:
+        return [
+            (company_id, band, (simhash >> (band * _BAND_BITS)) & _BAND_MASK)
+            for band in range(_BANDS)
+        ]
+
+    def update(self, report: Report) -> None:
+        """Indexes a report that has just been stored, replacing its previous
+        version."""
+        with self._lock:
+            previous = self._entries.pop(report.id, None)
+            if previous is not None:
+                for key in self._band_keys(previous[0], previous[1].simhash):
+                    self._bands[key].pop(report.id, None)
+                del self._reports[report.id]
+            if report.company_id is None or report.fingerprint is None:
+                return
+            entry = (
+                report.company_id,
+                Fingerprint.parse(report.fingerprint),
+                self._next_seq,
+            )
+            self._next_seq += 1
+            self._entries[report.id] = entry
+            self._reports[report.id] = report
+            for key in self._band_keys(entry[0], entry[1].simhash):
+                self._bands.setdefault(key, {})[report.id] = None
+
+    def find(self, company_id: str, document: Fingerprint) -> Report | None:
+        """Returns the latest report of the company whose document is a near-duplicate
+        of the given one and states the same numbers, if any."""
+        with self._lock:
+            # The closest document wins, then the latest one
+            best: tuple[int, int, str] | None = None
+            for key in self._band_keys(company_id, document.simhash):
+                for report_id in self._bands.get(key, {}):
+                    _, candidate, seq = self._entries[report_id]
+                    if candidate.numbers != document.numbers:
+                        continue
+                    distance = (candidate.simhash ^ document.simhash).bit_count()
+                    if distance > self.max_distance:
+                        continue
+                    if best is None or (-distance, seq) > (-best[0], best[1]):
+                        best = (distance, seq, report_id)
+            return None if best is None else self._reports[best[2]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import mailbox
+import os
+import zipfile
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from commons import FormData
+from parsing.mail import MailDocument, ParsedMessage, parse_message
+
+from .cache import normalize_document
+from .dedup import DuplicateIndex, fingerprint
+from .file_to_metrics import extract_metrics_async, parse_pool
+from .monitoring import count_failure
+from .prompt import load_prompt_template
+
+MAIL_MAX_IN_FLIGHT = int(os.getenv("MAIL_MAX_IN_FLIGHT", "32"))
+"""Maximum number of messages being parsed or extracted at the same time, which
+bounds the memory used by an import regardless of the size of the mailbox."""
+MAIL_STORE_BATCH = 100
+"""How many extracted documents are stored in a single write."""
+
+_PUBLIC_DOMAINS = frozenset(
+    {"gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "yahoo.com"}
+    | {"icloud.com", "proton.me", "protonmail.com", "live.com", "hotmail.es"}
+)
+
+
+class MailItemResult(BaseModel):
+    """The outcome of the extraction of a document found in an email, i.e. its body
+    or one of its attachments."""
+
+    message_id: str | None
+    sender: str | None
+    subject: str | None
+    document: str
+    """``body`` for the text of the email, otherwise the name of the attachment."""
+    company_id: str | None
+    form_data: FormData | None = None
+    duplicate_of: str | None = None
+    """The stored report whose metrics were reused, if the document is a
+    near-duplicate of the one it was extracted from."""
+    error: str | None = None
+    fingerprint: str | None = Field(default=None, exclude=True)
+
+
+def _digest(text: str) -> str:
+    """Identifies a text up to whitespace and case, to skip documents seen before."""
+    normalized = " ".join(normalize_document(text).split()).lower()
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+def iter_messages(path: Path) -> Iterator[bytes]:
+    """Yields the raw messages of an mbox file, of a ``.eml`` file, or of the ``.eml``
+    files in a directory or in a zip archive, one at a time."""
+    if path.is_dir():
+        for eml_path in sorted(path.rglob("*.eml")):
+            yield eml_path.read_bytes()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(".eml"):
+                    yield archive.read(info)
+    elif path.suffix.lower() == ".eml":
+        yield path.read_bytes()
+    else:
+        box = mailbox.mbox(path, create=False)
+        try:
+            for key in box.iterkeys():
+                yield box.get_bytes(key)
+        finally:
+            box.close()
+
+
+def company_of(sender: str | None) -> str | None:
+    """Guesses the company of a sender from the domain of their address, or the whole
+    address for the public email providers."""
+    if sender is None or "@" not in sender:
+        return None
+    domain = sender.rsplit("@", 1)[1].lower()
+    return sender.lower() if domain in _PUBLIC_DOMAINS else domain
+
+
+async def import_messages(
+    messages: Iterable[bytes], duplicates: DuplicateIndex | None = None
+) -> AsyncIterator[MailItemResult]:
+    """Extracts the metrics of the documents of many emails, yielding each result as
+    soon as it's ready.
+
+    The messages are parsed in `parse_pool`, then their documents are sent to the
+    LLM concurrently. At most `MAIL_MAX_IN_FLIGHT` messages are read ahead, so the
+    memory use doesn't depend on the number of messages. A document identical to one
+    seen earlier in the import, like an update quoted by a reply or forwarded again,
+    is skipped. A near-duplicate of a document already stored for the company in
+    ``duplicates`` reuses its metrics instead of being extracted again.
+
+    """
+    template_text = load_prompt_template()
+    seen: set[str] = set()
+    results: asyncio.Queue[MailItemResult | None] = asyncio.Queue(MAIL_MAX_IN_FLIGHT)
+    slots = asyncio.Semaphore(MAIL_MAX_IN_FLIGHT)
+
+    async def extract(parsed: ParsedMessage, document: MailDocument) -> MailItemResult:
+        document_fingerprint = fingerprint(document.text)
+        result = MailItemResult(
+            message_id=parsed.message_id,
+            sender=parsed.sender,
+            subject=parsed.subject,
+            document=document.name,
+            company_id=company_of(parsed.sender),
+            fingerprint=None
+            if document_fingerprint is None
+            else str(document_fingerprint),
+        )
+        if (
+            duplicates is not None
+            and result.company_id is not None
+            and document_fingerprint is not None
+        ):
+            duplicate = duplicates.find(result.company_id, document_fingerprint)
+            if duplicate is not None:
+                result.form_data = duplicate.form_data
+                result.duplicate_of = duplicate.id
+                return result
+        try:
+            result.form_data = await extract_metrics_async(document.text, template_text)
+        except Exception as e:
+            count_failure(e)
+            logger.warning(
+                f"Couldn't extract '{document.name}' of {parsed.message_id}: {e}"
+            )
+            result.error = str(e)
+        return result
+
+    async def process(raw: bytes) -> None:
+        try:
+            try:
+                parsed = await parse_pool.run(parse_message, raw)
+            except Exception as e:
+                count_failure(e)
+                logger.warning(f"Couldn't parse a message: {e}")
+                await results.put(
+                    MailItemResult(
+                        message_id=None,
+                        sender=None,
+                        subject=None,
+                        document="message",
+                        company_id=None,
+                        error=f"Couldn't parse the message: {e}",
+                    )
+                )
+                return
+            for name, error in parsed.errors:
+                await results.put(
+                    MailItemResult(
+                        message_id=parsed.message_id,
+                        sender=parsed.sender,
+                        subject=parsed.subject,
+                        document=name,
+                        company_id=company_of(parsed.sender),
+                        error=error,
+                    )
+                )
+            documents = []
+            for document in parsed.documents:
+                digest = _digest(document.text)
+                if digest in seen:
+                    logger.debug(f"Skipping '{document.name}' of {parsed.message_id}.")
+                    continue
+                seen.add(digest)
+                documents.append(document)
+            for result in await asyncio.gather(
+                *(extract(parsed, document) for document in documents)
+            ):
+                await results.put(result)
+        finally:
+            slots.release()
+
+    async def produce() -> None:
+        tasks: set[asyncio.Task[None]] = set()
+        try:
+            iterator = iter(messages)
+            while True:
+                await slots.acquire()
+                # Reading the next message may hit the disk, so it runs in a thread
+                raw = await asyncio.to_thread(next, iterator, None)
+                if raw is None:
+                    slots.release()
+                    break
+                task = asyncio.create_task(process(raw))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # When cancelled the consumer is gone, and the sentinel would wait forever
+            # for room in the queue
+            current = asyncio.current_task()
+            if current is None or current.cancelling() == 0:
+                await results.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+        await producer
+    finally:
+        producer.cancel()
@@ -0,0 +1,232 @@
+import csv
+import io
+import itertools
+import os
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Iterable, Iterator, Literal
+from xml.sax.saxutils import escape
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from commons import FormData
+
+from .db import Report
+from .normalization import field_kinds
+
+ExportFormat = Literal["csv", "xlsx", "parquet"]
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+"""How many reports are serialized at a time. Only one chunk is held in memory."""
+
+DECIMAL_SCALE = 6
+"""The number of decimal digits kept for the monetary fields in Parquet."""
+
+REPORT_COLUMNS = [
+    "id",
+    "company_id",
+    "period",
+    "sector",
+    "fund",
+    "state",
+    "created_at",
+    "updated_at",
+]
+COLUMNS = REPORT_COLUMNS + list(FormData.model_fields)
+"""The columns of the exports: the report metadata, then one per `FormData` field."""
+
+MEDIA_TYPES: dict[ExportFormat, str] = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def report_row(report: Report) -> list[Any]:
+    """Flattens a report in the order of `COLUMNS`."""
+    return [
+        report.id,
+        report.company_id,
+        report.period,
+        report.sector,
+        report.fund,
+        report.state.value,
+        report.created_at,
+        report.updated_at,
+    ] + [getattr(report.form_data, name) for name in FormData.model_fields]
+
+
+def _chunks(reports: Iterable[Report]) -> Iterator[list[Report]]:
+    iterator = iter(reports)
+    while chunk := list(itertools.islice(iterator, EXPORT_CHUNK_ROWS)):
+        yield chunk
+
+
+class _Sink(io.RawIOBase):
+    """A write-only file that hands out what has been written to it so far, so that
+    files can be streamed while they are being written."""
+
+    def __init__(self) -> None:
+        self._parts: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self._parts.append(bytes(data))
+        return len(self._parts[-1])
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_csv(reports: Iterable[Report]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+    for chunk in _chunks(reports):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            [_csv_value(value) for value in report_row(report)] for report in chunk
+        )
+        yield buffer.getvalue().encode("utf-8")
+
+
+_XLSX_CONTENT_TYPES = """\
+<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\
+<Default Extension="xml" ContentType="application/xml"/>\
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>\
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>\
+</Types>"""
+_XLSX_RELS = """\
+<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>\
+</Relationships>"""
+_XLSX_WORKBOOK = """\
+<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" \
+xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">\
+<sheets><sheet name="Reports" sheetId="1" r:id="rId1"/></sheets></workbook>"""
+_XLSX_WORKBOOK_RELS = """\
+<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>\
+</Relationships>"""
+_XLSX_SHEET_START = """\
+<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>"""
+_XLSX_SHEET_END = "</sheetData></worksheet>"
+
+
+def _xlsx_cell(value: Any) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_rows(rows: Iterable[list[Any]]) -> bytes:
+    return "".join(
+        "<row>" + "".join(map(_xlsx_cell, row)) + "</row>" for row in rows
+    ).encode("utf-8")
+
+
+def export_xlsx(reports: Iterable[Report]) -> Iterator[bytes]:
+    """Writes a workbook with a single sheet, row by row.
+
+    openpyxl can only save a whole workbook at once, so the parts of the file are
+    written directly, with the cells inline, in a zip archive that is streamed as it
+    grows.
+
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _XLSX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _XLSX_RELS)
+        archive.writestr("xl/workbook.xml", _XLSX_WORKBOOK)
+        archive.writestr("xl/_rels/workbook.xml.rels", _XLSX_WORKBOOK_RELS)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(_XLSX_SHEET_START.encode("utf-8"))
+            sheet.write(_xlsx_rows([COLUMNS]))
+            yield sink.take()
+            for chunk in _chunks(reports):
+                sheet.write(_xlsx_rows(report_row(report) for report in chunk))
+                yield sink.take()
+            sheet.write(_XLSX_SHEET_END.encode("utf-8"))
+    yield sink.take()
+
+
+_ARROW_TYPES: dict[str, pa.DataType] = {
+    "int": pa.int64(),
+    "float": pa.float64(),
+    "decimal": pa.decimal128(38, DECIMAL_SCALE),
+}
+_DECIMAL_QUANTUM = Decimal(1).scaleb(-DECIMAL_SCALE)
+
+
+def arrow_schema() -> pa.Schema:
+    """The Arrow schema of the reports, with the monetary fields as decimals."""
+    kinds = field_kinds(FormData)
+    timestamp = pa.timestamp("us", tz="UTC")
+    fields: list[pa.Field] = [
+        pa.field(name, pa.string()) for name in REPORT_COLUMNS[:6]
+    ]
+    fields += [pa.field("created_at", timestamp), pa.field("updated_at", timestamp)]
+    fields += [
+        pa.field(name, _ARROW_TYPES[kinds[name]]) for name in FormData.model_fields
+    ]
+    return pa.schema(fields)
+
+
+def reports_to_table(reports: list[Report], schema: pa.Schema) -> pa.Table:
+    """Converts reports to an Arrow table, one column at a time."""
+    rows = [report_row(report) for report in reports]
+    columns: dict[str, list[Any]] = {}
+    for column_idx, name in enumerate(COLUMNS):
+        values = [row[column_idx] for row in rows]
+        if pa.types.is_decimal(schema.field(name).type):
+            values = [
+                None if value is None else value.quantize(_DECIMAL_QUANTUM)
+                for value in values
+            ]
+        columns[name] = values
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def export_parquet(reports: Iterable[Report]) -> Iterator[bytes]:
+    """Writes one row group per chunk of reports."""
+    schema = arrow_schema()
+    sink = _Sink()
+    with pq.ParquetWriter(
+        pa.PythonFile(sink, mode="w"), schema, compression="zstd"
+    ) as writer:
+        yield sink.take()
+        for chunk in _chunks(reports):
+            writer.write_table(reports_to_table(chunk, schema))
+            yield sink.take()
+    yield sink.take()
+
+
+EXPORTERS: dict[ExportFormat, Callable[[Iterable[Report]], Iterator[bytes]]] = {
+    "csv": export_csv,
+    "xlsx": export_xlsx,
+    "parquet": export_parquet,
+}
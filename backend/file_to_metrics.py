@@ -1,77 +1,614 @@
-import pandas as pd
-from openai import OpenAI
+import asyncio
+import contextvars
+import csv
+import os
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from decimal import Decimal
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterator,
+    NamedTuple,
+    TypeVar,
+)
+
+import httpx
+import openai
+from openai import AsyncOpenAI, AsyncStream, OpenAI
+from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionChunk,
+    ChatCompletionMessageParam,
+)
+from openai.types.chat.completion_create_params import ResponseFormat
 
 from dotenv import load_dotenv
+from loguru import logger
+from pydantic import ValidationError
 
 from commons import FormData
+from parsing.spreadsheet import workbook_to_text
+
+from .cache import ExtractionCache, make_cache_key
+from .chunking import merge_chunk_results, split_into_chunks
+from .compaction import compact_document, estimate_tokens
+from .monitoring import count_failure
+from .normalization import normalize_fields, normalize_json, parse_value
+from .parse_pool import ParsePool
+from .partial_json import PartialObjectParser
+from .prompt import TEMPLATE_PATH, compile_prompt, load_prompt_template
+from .repair import (
+    RepairRequest,
+    build_repair_request,
+    fields_to_repair,
+    parse_repair_response,
+)
+from .synonyms import match_field
+from .tracing import record_llm_usage, stage
 
 load_dotenv()
 
 client = OpenAI()
 
+MODEL = "gpt-4o-mini"  # cheap, fast; swap if needed
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+"""Maximum number of LLM calls in flight at the same time on the async path."""
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+"""Timeout of a single LLM call."""
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+"""How many times a failed LLM call is retried before giving up."""
+
+async_client = AsyncOpenAI(
+    http_client=openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONCURRENCY,
+            max_keepalive_connections=LLM_MAX_CONCURRENCY,
+        ),
+    ),
+    # Retries are handled by `call_openai_async`, with jittered backoff
+    max_retries=0,
+)
+"""Client shared by all the async extractions, so that connections are pooled."""
+
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+T = TypeVar("T")
+
+extraction_cache = ExtractionCache.from_env()
+
+parse_pool = ParsePool.from_env()
+"""Worker processes for the CPU-bound parsing stages of the async path."""
+
+
+def excel_to_text(excel_file: str | bytes, file_name: str = "") -> str:
+    """Reads an Excel file, given as a path or as its contents, and returns a plain
+    text representation of all its sheets."""
+    if isinstance(excel_file, str):
+        file_name = excel_file
+        with stage("read"), open(excel_file, "rb") as f:
+            excel_file = f.read()
+    with stage("sheet_to_text"):
+        return workbook_to_text(excel_file, file_name)
+
+
+def build_prompt(template: str, content: str, fields: list[str] | None = None) -> str:
+    """Fills the {content} placeholder with the text and {json_structure} with the
+    fields to extract.
 
-def excel_to_text(excel_path: str) -> str:
-    """Reads an Excel file and returns a plain text representation."""
-    df = pd.read_excel(excel_path)
-    return df.to_csv(index=False)  # simple: CSV-like text
+    All the `FormData` fields are requested unless ``fields`` is given. The template
+    is compiled with the `FormData` schema only the first time it's used.
 
+    """
+    return compile_prompt(template, FormData).render(content, fields)
 
-def load_prompt_template(template_path: str) -> str:
-    """Loads the template text file."""
-    with open(template_path, "r", encoding="utf-8") as f:
-        return f.read()
 
+def _iter_rows(content: str) -> Iterator[list[str]]:
+    """Yields the cells of each row of the tables, CSV lines and "key: value" lines of
+    a document."""
+    for line in content.splitlines():
+        line = line.strip()
+        if line == "":
+            continue
+        if line.startswith("|"):
+            if re.fullmatch(r"[\s|:-]+", line):
+                # Markdown separator row
+                continue
+            yield [cell.strip() for cell in line.strip("|").split("|")]
+        elif "\t" in line:
+            yield [cell.strip() for cell in line.split("\t")]
+        elif ";" in line or "," in line:
+            delimiter = ";" if line.count(";") >= line.count(",") else ","
+            cells = next(csv.reader([line], delimiter=delimiter))
+            if ":" in cells[0]:
+                yield [cell.strip() for cell in line.split(":", 1)]
+            else:
+                yield [cell.strip() for cell in cells]
+        elif ":" in line:
+            yield [cell.strip() for cell in line.split(":", 1)]
 
-def build_prompt(template: str, content: str) -> str:
-    """Fills the {content} placeholder with Excel text."""
-    return template.replace("{content}", content)
 
+def extract_metrics_with_rules(content: str) -> dict[str, Any]:
+    """Extracts the metrics that a document maps unambiguously from a label to a value.
 
-def call_openai(prompt: str) -> str:
+    Markdown tables, CSV exports and "key: value" lines are recognized through the
+    synonyms in `synonyms.FIELD_SYNONYMS`. Fields that are missing, that appear more
+    than once with different values, whose row has several different values, like a
+    table with a column per period, or whose value isn't valid are left out.
+
+    """
+    candidates: dict[str, Decimal] = {}
+    ambiguous: set[str] = set()
+    for cells in _iter_rows(content):
+        if len(cells) < 2:
+            continue
+        field_name = match_field(cells[0])
+        if field_name is None:
+            continue
+        values = {
+            parsed for parsed in map(parse_value, cells[1:]) if parsed is not None
+        }
+        if len(values) == 0:
+            continue
+        if len(values) > 1:
+            # E.g. a column per period: which one is current is up to the LLM
+            ambiguous.add(field_name)
+            continue
+        value = values.pop()
+        if field_name in candidates and candidates[field_name] != value:
+            ambiguous.add(field_name)
+        candidates[field_name] = value
+    for field_name in ambiguous:
+        logger.debug(f"Ambiguous values for `{field_name}`, deferring to the LLM.")
+        candidates.pop(field_name, None)
+
+    # Drop the values that don't fit the type of their field, e.g. fractional counts
+    normalized = normalize_fields(candidates)
+    return {
+        field_name: value
+        for field_name, value in normalized.items()
+        if value is not None
+    }
+
+
+def _chat_messages(prompt: str) -> list[ChatCompletionMessageParam]:
+    return [
+        {"role": "system", "content": "You are a JSON extractor assistant."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+_JSON_OBJECT: ResponseFormat = {"type": "json_object"}
+
+
+def call_openai(prompt: str, response_format: ResponseFormat = _JSON_OBJECT) -> str:
     """Sends the prompt to OpenAI and returns the response text."""
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",  # cheap, fast; swap if needed
-        temperature=0,
-        messages=[
-            {"role": "system", "content": "You are a JSON extractor assistant."},
-            {"role": "user", "content": prompt},
-        ],
-        response_format={"type": "json_object"},
-    )
+    with stage("llm"):
+        response = client.chat.completions.create(
+            model=MODEL,
+            temperature=0,
+            messages=_chat_messages(prompt),
+            response_format=response_format,
+        )
+    if response.usage is not None:
+        record_llm_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+    result = response.choices[0].message.content
+    return result if result is not None else ""
+
+
+_RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+async def _retrying(call: Callable[[], Awaitable[T]]) -> T:
+    """Awaits ``call()``, retrying transient failures up to `LLM_MAX_RETRIES` times
+    with exponential backoff and full jitter, so that concurrent retries don't hit the
+    API in lockstep."""
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except _RETRYABLE_ERRORS as e:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(30.0, 0.5 * 2**attempt))
+            logger.warning(
+                f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s."
+            )
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+async def call_openai_async(
+    prompt: str, response_format: ResponseFormat = _JSON_OBJECT
+) -> str:
+    """Sends the prompt to OpenAI without blocking the event loop.
+
+    At most `LLM_MAX_CONCURRENCY` calls are in flight at any time, and the slot is
+    released while waiting to retry a transient failure.
+
+    """
+
+    async def create() -> ChatCompletion:
+        async with llm_semaphore:
+            with stage("llm"):
+                return await async_client.chat.completions.create(
+                    model=MODEL,
+                    temperature=0,
+                    messages=_chat_messages(prompt),
+                    response_format=response_format,
+                    timeout=LLM_TIMEOUT_SECONDS,
+                )
+
+    response = await _retrying(create)
+    if response.usage is not None:
+        record_llm_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
     result = response.choices[0].message.content
     return result if result is not None else ""
 
 
+async def call_openai_stream(prompt: str) -> AsyncIterator[str]:
+    """Sends the prompt to OpenAI and yields the pieces of the response as they are
+    generated.
+
+    Like `call_openai_async`, this holds one of the `LLM_MAX_CONCURRENCY` slots while
+    running, and releases it while waiting to retry a transient failure. Only the
+    opening of the stream is retried, since a response that broke halfway can't be
+    resumed.
+
+    """
+
+    async def open_stream() -> AsyncStream[ChatCompletionChunk]:
+        # The slot is kept past a successful attempt, until the stream is consumed
+        await llm_semaphore.acquire()
+        try:
+            return await async_client.chat.completions.create(
+                model=MODEL,
+                temperature=0,
+                messages=_chat_messages(prompt),
+                response_format=_JSON_OBJECT,
+                timeout=LLM_TIMEOUT_SECONDS,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        except BaseException:
+            llm_semaphore.release()
+            raise
+
+    stream = await _retrying(open_stream)
+    try:
+        with stage("llm"):
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    record_llm_usage(
+                        chunk.usage.prompt_tokens, chunk.usage.completion_tokens
+                    )
+                if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    finally:
+        llm_semaphore.release()
+
+
+@dataclass
+class _ExtractionPlan:
+    """What's left to do to extract the metrics of a document."""
+
+    content: str
+    cache_key: str
+    cached: FormData | None
+    """The cached result, if the document has already been extracted."""
+    resolved: dict[str, Any]
+    """The fields resolved by the rule-based extractor."""
+    chunks: list[str]
+    """The parts of the document sent to the LLM, one per prompt."""
+    prompts: list[str]
+    """The prompts for the remaining fields, empty if no LLM call is needed."""
+
+
+def _plan_extraction(content_text: str, template_text: str) -> _ExtractionPlan:
+    cache_key = make_cache_key(content_text, template_text, MODEL)
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        return _ExtractionPlan(content_text, cache_key, cached, {}, [], [])
+
+    # Templated reports are mostly resolved locally, the LLM only sees what's left
+    with stage("rules"):
+        resolved = extract_metrics_with_rules(content_text)
+    missing = [name for name in FormData.model_fields if name not in resolved]
+    logger.info(
+        f"{len(resolved)} fields resolved by rules, {len(missing)} sent to the LLM."
+    )
+    chunks: list[str] = []
+    with stage("prompt_build"):
+        if len(missing) > 0:
+            # Long documents are extracted in chunks, each one compacted on its own
+            for chunk in split_into_chunks(content_text):
+                compacted = compact_document(chunk, missing)
+                if compacted.text != "":
+                    chunks.append(compacted.text)
+            tokens_after = sum(estimate_tokens(chunk) for chunk in chunks)
+            logger.info(
+                f"Compacted the document from {estimate_tokens(content_text)} to "
+                f"{tokens_after} tokens, in {len(chunks)} chunks."
+            )
+        prompts = [build_prompt(template_text, chunk, missing) for chunk in chunks]
+    return _ExtractionPlan(content_text, cache_key, None, resolved, chunks, prompts)
+
+
+def _merge_results(
+    plan: _ExtractionPlan, results_json: list[str]
+) -> tuple[dict[str, Any], RepairRequest | None]:
+    """Validates the LLM responses and merges them with the rule-based fields.
+
+    Also returns the request that repairs the fields that are still invalid or
+    missing, if any.
+
+    """
+    errors: dict[str, str] = {}
+    with stage("validation"):
+        results = [
+            FormData.model_validate(
+                normalize_json(result_json, errors=errors)
+            ).model_dump(exclude_none=True)
+            for result_json in results_json
+        ]
+        merged = merge_chunk_results(plan.chunks, results) | plan.resolved
+    with stage("prompt_build"):
+        invalid = [name for name in errors if name not in merged]
+        fields = fields_to_repair(plan.content, merged, invalid)
+        repair = build_repair_request(plan.content, fields) if fields else None
+    if repair is not None:
+        logger.info(f"Repairing {len(fields)} fields: {', '.join(fields)}.")
+    return merged, repair
+
+
+def _repaired_fields(repair: RepairRequest, result_json: str) -> dict[str, Any]:
+    try:
+        return parse_repair_response(repair, result_json)
+    except ValueError as e:
+        logger.warning(f"Ignoring the invalid repair response: {e}")
+        return {}
+
+
+def _finish_extraction(
+    plan: _ExtractionPlan,
+    merged: dict[str, Any],
+    repaired: dict[str, Any] | None = None,
+) -> FormData:
+    with stage("validation"):
+        metrics = FormData.model_validate(merged | (repaired or {}))
+    extraction_cache.put(plan.cache_key, metrics)
+    return metrics
+
+
+def extract_metrics(content_text: str, template_text: str) -> FormData:
+    """Extracts the metrics from a text, going through the extraction cache.
+
+    Repeated documents are served from the cache without calling the LLM. The fields
+    that the rule-based extractor can resolve aren't requested from the LLM either.
+    Long documents are split in chunks that are extracted concurrently. The fields
+    that come back invalid, or missing although the document seems to state them, are
+    then requested again in a single, much smaller call with only the relevant excerpt
+    of the document.
+
+    """
+    plan = _plan_extraction(content_text, template_text)
+    if plan.cached is not None:
+        return plan.cached
+    with ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY) as executor:
+        # Each call runs in a copy of the context, so that it's part of the trace
+        futures = [
+            executor.submit(contextvars.copy_context().run, call_openai, prompt)
+            for prompt in plan.prompts
+        ]
+        results_json = [future.result() for future in futures]
+    merged, repair = _merge_results(plan, results_json)
+    repaired: dict[str, Any] = {}
+    if repair is not None:
+        try:
+            result_json = call_openai(repair.prompt, repair.response_format)
+        except openai.OpenAIError as e:
+            logger.warning(f"The repair failed, keeping the first pass: {e}")
+        else:
+            repaired = _repaired_fields(repair, result_json)
+    return _finish_extraction(plan, merged, repaired)
+
+
+async def extract_metrics_async(content_text: str, template_text: str) -> FormData:
+    """Async version of `extract_metrics`, which doesn't block the event loop."""
+    plan = _plan_extraction(content_text, template_text)
+    if plan.cached is not None:
+        return plan.cached
+    results_json = await asyncio.gather(
+        *(call_openai_async(prompt) for prompt in plan.prompts)
+    )
+    merged, repair = _merge_results(plan, list(results_json))
+    repaired = {} if repair is None else await _repair_async(repair)
+    return _finish_extraction(plan, merged, repaired)
+
+
+async def _repair_async(repair: RepairRequest) -> dict[str, Any]:
+    try:
+        result_json = await call_openai_async(repair.prompt, repair.response_format)
+    except openai.OpenAIError as e:
+        logger.warning(f"The repair failed, keeping the first pass: {e}")
+        return {}
+    return _repaired_fields(repair, result_json)
+
+
+class FieldUpdate(NamedTuple):
+    """A field of `FormData`, in its JSON representation, that has been extracted."""
+
+    name: str
+    value: Any
+
+
+def _field_update(name: str, value: Any) -> FieldUpdate | None:
+    """Normalizes and validates a single extracted field, returning `None` if it's
+    invalid."""
+    normalized = normalize_fields({name: value})
+    if normalized.get(name) is None:
+        return None
+    try:
+        form_data = FormData.model_validate(normalized)
+    except ValidationError as e:
+        logger.warning(f"Discarding the invalid value {value!r} of '{name}': {e}")
+        return None
+    return FieldUpdate(name, form_data.model_dump(mode="json")[name])
+
+
+async def extract_metrics_stream(
+    content_text: str, template_text: str
+) -> AsyncIterator[FieldUpdate | FormData]:
+    """Extracts the metrics from a text, yielding each field as soon as it's known.
+
+    Cached and rule-based fields are yielded right away, then the LLM responses are
+    streamed and parsed incrementally, so every field is yielded as soon as its value
+    is complete. When a document is split in chunks, the first value found for a
+    field is yielded. The fields fixed by the repair pass follow, and the complete
+    `FormData`, in which chunk conflicts are resolved like in `extract_metrics`, is
+    yielded last.
+
+    """
+    plan = _plan_extraction(content_text, template_text)
+    if plan.cached is not None:
+        for name, value in plan.cached.model_dump(mode="json").items():
+            if value is not None:
+                yield FieldUpdate(name, value)
+        yield plan.cached
+        return
+    emitted: set[str] = set()
+    for name, value in plan.resolved.items():
+        update = _field_update(name, value)
+        if update is not None:
+            emitted.add(name)
+            yield update
+
+    updates: asyncio.Queue[tuple[str, Any] | BaseException | None] = asyncio.Queue()
+    responses = ["" for _ in plan.prompts]
+
+    async def stream_prompt(prompt_idx: int) -> None:
+        parser = PartialObjectParser()
+        try:
+            async for piece in call_openai_stream(plan.prompts[prompt_idx]):
+                responses[prompt_idx] += piece
+                for member in parser.feed(piece):
+                    updates.put_nowait(member)
+        except BaseException as e:
+            updates.put_nowait(e)
+            raise
+        updates.put_nowait(None)
+
+    tasks = [
+        asyncio.create_task(stream_prompt(prompt_idx))
+        for prompt_idx in range(len(plan.prompts))
+    ]
+    try:
+        running = len(tasks)
+        while running > 0:
+            item = await updates.get()
+            if item is None:
+                running -= 1
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            name, value = item
+            if name in emitted or name not in FormData.model_fields or value is None:
+                continue
+            update = _field_update(name, value)
+            if update is not None:
+                emitted.add(name)
+                yield update
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    merged, repair = _merge_results(plan, responses)
+    repaired = {} if repair is None else await _repair_async(repair)
+    for name, value in repaired.items():
+        update = _field_update(name, value)
+        if update is not None and name not in emitted:
+            yield update
+    yield _finish_extraction(plan, merged, repaired)
+
+
 def parse_excel_to_metrics(
-    file_contents: str, template_path: str = "template.txt"
+    file_contents: bytes, file_name: str = "", template_path: str | Path = TEMPLATE_PATH
 ) -> FormData:
-    """Parses metrics from an Excel file into FormData."""
-    content_text = excel_to_text(file_contents)
+    """Parses metrics from the contents of an Excel file into FormData."""
+    content_text = excel_to_text(file_contents, file_name)
     template_text = load_prompt_template(template_path)
-    prompt = build_prompt(template_text, content_text)
-
-    result_json = call_openai(prompt)
-    return FormData.model_validate_json(result_json)
+    return extract_metrics(content_text, template_text)
 
 
 def parse_text_to_metrics(
-    file_content: str, template_path: str = "template.txt"
+    file_content: str, template_path: str | Path = TEMPLATE_PATH
 ) -> FormData:
     """Parses metrics from plain text/CSV into FormData."""
     template_text = load_prompt_template(template_path)
-    prompt = build_prompt(template_text, file_content)
+    return extract_metrics(file_content, template_text)
+
+
+async def excel_to_text_async(file_bytes: bytes, file_name: str = "") -> str:
+    """Async version of `excel_to_text`, which reads the workbook in `parse_pool`."""
+    with stage("sheet_to_text"):
+        return await parse_pool.run(workbook_to_text, file_bytes, file_name)
+
+
+async def parse_excel_to_metrics_async(
+    file_contents: bytes, file_name: str = "", template_path: str | Path = TEMPLATE_PATH
+) -> FormData:
+    """Async version of `parse_excel_to_metrics`."""
+    content_text = await excel_to_text_async(file_contents, file_name)
+    template_text = load_prompt_template(template_path)
+    return await extract_metrics_async(content_text, template_text)
+
+
+async def parse_text_to_metrics_async(
+    file_content: str, template_path: str | Path = TEMPLATE_PATH
+) -> FormData:
+    """Async version of `parse_text_to_metrics`."""
+    template_text = load_prompt_template(template_path)
+    return await extract_metrics_async(file_content, template_text)
+
+
+async def file_to_text_async(file_name: str, file_bytes: bytes) -> str:
+    """Converts an uploaded file to text, picking the reader from its extension."""
+    if file_name.lower().endswith((".xlsx", ".xls")):
+        # Workbooks are binary, so they are parsed from the raw bytes
+        return await excel_to_text_async(file_bytes, file_name)
+    # Assume text/CSV file parsing
+    with stage("decode"):
+        return file_bytes.decode("utf-8")
+
 
-    result_json = call_openai(prompt)
-    return FormData.model_validate_json(result_json)
+async def parse_file_to_metrics_async(file_name: str, file_bytes: bytes) -> FormData:
+    """Parses metrics from an uploaded file, picking the parser from its extension."""
+    try:
+        content_text = await file_to_text_async(file_name, file_bytes)
+        template_text = load_prompt_template()
+        return await extract_metrics_async(content_text, template_text)
+    except Exception as e:
+        count_failure(e)
+        raise
 
 
 if __name__ == "__main__":
     # Example usage
     excel_file = "data.xlsx"
-    template_file = "template.txt"
 
     content_text = excel_to_text(excel_file)
-    template_text = load_prompt_template(template_file)
+    template_text = load_prompt_template()
     prompt = build_prompt(template_text, content_text)
 
     result = call_openai(prompt)
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from enum import Enum, unique
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from commons import FormData
+
+
+@unique
+class JobStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    """An extraction that is processed in the background."""
+
+    id: str
+    file_name: str
+    company_id: str | None = None
+    period: str | None = None
+    status: JobStatus = JobStatus.PENDING
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: datetime | None = None
+    result: FormData | None = None
+    """The extracted metrics, once the job is done."""
+    fingerprint: str | None = None
+    """The fingerprint of the document, stored with its report."""
+    duplicate_of: str | None = None
+    """The stored report whose metrics were reused, if the document is a
+    near-duplicate of the one it was extracted from."""
+    error: str | None = None
+    """Why the job failed, if it did."""
+
+
+_PURGE_INTERVAL_SECONDS = 600.0
+
+JobProcessor = Callable[[Job, bytes], Awaitable[FormData]]
+"""Extracts the metrics of a job from the contents of its uploaded file."""
+
+
+class JobQueue:
+    """Queue of extraction jobs processed by a pool of asyncio workers.
+
+    Every job is written to ``jobs_dir`` before being acknowledged, together with the
+    uploaded file, so that the jobs still pending when the server stops are picked up
+    again on the next start. Finished jobs are deleted ``retention`` after they end.
+
+    """
+
+    def __init__(
+        self,
+        jobs_dir: Path,
+        num_workers: int,
+        process: JobProcessor,
+        on_done: Callable[[Job], None],
+        retention: timedelta = timedelta(days=1),
+    ) -> None:
+        self.jobs_dir = jobs_dir
+        self.num_workers = num_workers
+        self.retention = retention
+        self._process = process
+        self._on_done = on_done
+        self._jobs: dict[str, Job] = {}
+        self._finished: dict[str, asyncio.Event] = {}
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._workers: list[asyncio.Task[None]] = []
+
+    @classmethod
+    def from_env(
+        cls, process: JobProcessor, on_done: Callable[[Job], None]
+    ) -> "JobQueue":
+        """Builds the queue from the ``JOBS_DIR``, ``JOB_WORKERS`` and
+        ``JOB_RETENTION_HOURS`` environment variables."""
+        return cls(
+            jobs_dir=Path(os.getenv("JOBS_DIR", ".jobs")),
+            num_workers=int(os.getenv("JOB_WORKERS", "4")),
+            process=process,
+            on_done=on_done,
+            retention=timedelta(hours=float(os.getenv("JOB_RETENTION_HOURS", "24"))),
+        )
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _payload_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.bin"
+
+    def _persist(self, job: Job) -> None:
+        tmp_path = self._job_path(job.id).with_suffix(".tmp")
+        tmp_path.write_text(job.model_dump_json(), encoding="utf-8")
+        tmp_path.replace(self._job_path(job.id))
+
+    def _expired(self, job: Job, now: datetime) -> bool:
+        return (
+            job.finished_at is not None
+            and job.status in (JobStatus.DONE, JobStatus.FAILED)
+            and now - job.finished_at > self.retention
+        )
+
+    def _delete(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._finished.pop(job_id, None)
+        self._job_path(job_id).unlink(missing_ok=True)
+        self._payload_path(job_id).unlink(missing_ok=True)
+
+    def purge(self) -> int:
+        """Deletes the jobs that finished more than ``retention`` ago and returns how
+        many there were."""
+        now = datetime.now(timezone.utc)
+        expired = [job.id for job in self._jobs.values() if self._expired(job, now)]
+        for job_id in expired:
+            self._delete(job_id)
+        return len(expired)
+
+    async def _purge_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(_PURGE_INTERVAL_SECONDS)
+            purged = self.purge()
+            if purged > 0:
+                logger.info(f"Deleted {purged} expired extraction jobs.")
+
+    def _register(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        event = asyncio.Event()
+        if job.status in (JobStatus.DONE, JobStatus.FAILED):
+            event.set()
+        self._finished[job.id] = event
+
+    async def start(self) -> None:
+        """Reloads the persisted jobs and starts the workers."""
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        resumed = 0
+        now = datetime.now(timezone.utc)
+        for path in sorted(self.jobs_dir.glob("*.json")):
+            try:
+                job = Job.model_validate_json(path.read_bytes())
+            except ValueError:
+                logger.warning(f"Skipping the corrupted job file '{path}'.")
+                continue
+            if self._expired(job, now):
+                self._delete(job.id)
+                continue
+            if job.status in (JobStatus.PENDING, JobStatus.RUNNING):
+                if not self._payload_path(job.id).exists():
+                    job.status = JobStatus.FAILED
+                    job.error = "The uploaded file was lost."
+                    self._persist(job)
+                else:
+                    job.status = JobStatus.PENDING
+                    self._queue.put_nowait(job.id)
+                    resumed += 1
+            self._register(job)
+        if resumed > 0:
+            logger.info(f"Resumed {resumed} pending extraction jobs.")
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.num_workers)
+        ]
+        self._workers.append(asyncio.create_task(self._purge_periodically()))
+
+    async def stop(self) -> None:
+        """Stops the workers.
+
+        Jobs that are being processed stay pending on disk and are resumed on the next
+        start.
+
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(
+        self,
+        file_name: str,
+        file_bytes: bytes,
+        company_id: str | None = None,
+        period: str | None = None,
+    ) -> Job:
+        """Persists a new job and enqueues it."""
+        job = Job(
+            id=uuid.uuid4().hex,
+            file_name=file_name,
+            company_id=company_id,
+            period=period,
+        )
+        self._payload_path(job.id).write_bytes(file_bytes)
+        self._persist(job)
+        self._register(job)
+        self._queue.put_nowait(job.id)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Job | None:
+        """Waits up to ``timeout`` seconds for a job to finish and returns it."""
+        event = self._finished.get(job_id)
+        if event is None:
+            return None
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._jobs[job_id]
+
+    def depth(self) -> int:
+        """Returns the number of jobs waiting for a worker."""
+        return self._queue.qsize()
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(self._jobs[job_id])
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status = JobStatus.RUNNING
+        self._persist(job)
+        payload_path = self._payload_path(job.id)
+        try:
+            job.result = await self._process(job, payload_path.read_bytes())
+            job.status = JobStatus.DONE
+            self._on_done(job)
+        except asyncio.CancelledError:
+            job.status = JobStatus.PENDING
+            self._persist(job)
+            raise
+        except Exception as e:
+            logger.exception(f"Extraction job {job.id} failed.")
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+        job.finished_at = datetime.now(timezone.utc)
+        self._persist(job)
+        payload_path.unlink(missing_ok=True)
+        self._finished[job.id].set()
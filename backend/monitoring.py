@@ -0,0 +1,114 @@
+import sys
+from typing import Callable
+
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+
+_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "extraction_stage_seconds",
+    "Wall time of each stage of the extraction pipeline.",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Tokens used by the LLM calls, from the API usage.", ["kind"]
+)
+LLM_PROMPT_TOKENS = LLM_TOKENS.labels("prompt")
+LLM_COMPLETION_TOKENS = LLM_TOKENS.labels("completion")
+EXTRACTION_FAILURES = Counter(
+    "extraction_failures_total",
+    "Extractions that failed, by type of error.",
+    ["error_type"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Time to serve each API request.",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+STORED_REPORTS = Gauge("stored_reports", "Number of reports in the store.")
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth", "Number of extraction jobs waiting for a worker."
+)
+
+PARSE_POOL_TASKS = Counter(
+    "parse_pool_tasks_total",
+    "Tasks run by the parsing processes, by function and outcome.",
+    ["task", "outcome"],
+)
+PARSE_POOL_TASK_SECONDS = Histogram(
+    "parse_pool_task_seconds",
+    "Time from the submission of a parsing task to its result, queueing included.",
+    ["task"],
+    buckets=_LATENCY_BUCKETS,
+)
+PARSE_POOL_INPUT_BYTES = Counter(
+    "parse_pool_input_bytes_total",
+    "Bytes sent to the parsing processes.",
+    ["task"],
+)
+PARSE_POOL_IN_FLIGHT = Gauge(
+    "parse_pool_in_flight", "Parsing tasks submitted and not finished yet."
+)
+PARSE_POOL_RESTARTS = Counter(
+    "parse_pool_restarts_total",
+    "Times the parsing pool was replaced after a worker process died.",
+)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def record_tokens(prompt_tokens: int, completion_tokens: int) -> None:
+    LLM_PROMPT_TOKENS.inc(prompt_tokens)
+    LLM_COMPLETION_TOKENS.inc(completion_tokens)
+
+
+def count_failure(error: BaseException) -> None:
+    EXTRACTION_FAILURES.labels(type(error).__name__).inc()
+
+
+def track_gauges(
+    stored_reports: Callable[[], float], queue_depth: Callable[[], float]
+) -> None:
+    """Makes the gauges read their values when they are scraped, so that keeping them
+    up to date costs nothing on the hot path."""
+    STORED_REPORTS.set_function(stored_reports)
+    JOB_QUEUE_DEPTH.set_function(queue_depth)
+
+
+def configure_logging() -> None:
+    """Adds the id of the request being served to every log line.
+
+    The id is bound with ``logger.contextualize(trace_id=...)`` and is ``-`` outside
+    of requests.
+
+    """
+    logger.configure(extra={"trace_id": "-"})
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        format=(
+            "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
+            "<level>{level: <8}</level> | <yellow>{extra[trace_id]}</yellow> | "
+            "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+            "<level>{message}</level>"
+        ),
+    )
@@ -0,0 +1,193 @@
+import functools
+import json
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Any, Literal, Mapping, get_args
+
+from loguru import logger
+from pydantic import BaseModel
+
+from commons import FormData
+
+FieldKind = Literal["int", "float", "decimal"]
+
+_VALUE_PATTERN = re.compile(
+    r"""^(?P<sign>[-−])?\s*~?\s*(?:(?:[€$£]|eur|usd|gbp)\s*)?
+    (?P<number>\d[\d.,\s'’]*?)\s*
+    (?P<suffix>k|mm|m|bn|b|mil|mill|millones|million|millions|thousand|thousands
+    |x|veces|times|%|meses|mes|months|month)?\.?\s*
+    (?:€|eur|euros|usd|\$|£|gbp)?$""",
+    re.IGNORECASE | re.VERBOSE,
+)
+
+_SUFFIX_MULTIPLIERS = {
+    "k": Decimal(1_000),
+    "mil": Decimal(1_000),
+    "thousand": Decimal(1_000),
+    "thousands": Decimal(1_000),
+    "m": Decimal(1_000_000),
+    "mm": Decimal(1_000_000),
+    "mill": Decimal(1_000_000),
+    "millones": Decimal(1_000_000),
+    "million": Decimal(1_000_000),
+    "millions": Decimal(1_000_000),
+    "b": Decimal(1_000_000_000),
+    "bn": Decimal(1_000_000_000),
+}
+
+_MISSING_VALUES = frozenset({"", "-", "–", "n/a", "na", "n.a.", "none", "null", "nd"})
+
+
+def _groups_thousands(integer_part: str, fractional_part: str) -> bool:
+    return (
+        len(fractional_part) == 3
+        and integer_part not in ("", "0")
+        and len(integer_part) <= 3
+    )
+
+
+def parse_number(digits: str) -> Decimal | None:
+    """Parses a number whose thousands and decimal separators can be either `,` or
+    `.`, as in the English and in most European locales.
+
+    Spaces and apostrophes, used by the French and Swiss locales, always group
+    thousands. A single separator followed by exactly three digits is taken as a
+    thousands separator, e.g. ``1.780`` is 1780, unless what precedes it can't be a
+    group of thousands, i.e. it's empty, ``0`` or longer than three digits, so that
+    ``0.125`` is 0.125 and ``2184,500`` is 2184.5.
+
+    """
+    digits = re.sub(r"[\s'’]", "", digits)
+    if "," in digits and "." in digits:
+        decimal_separator = "," if digits.rfind(",") > digits.rfind(".") else "."
+    elif digits.count(",") == 1 and not _groups_thousands(*digits.split(",")):
+        decimal_separator = ","
+    elif digits.count(".") == 1 and not _groups_thousands(*digits.split(".")):
+        decimal_separator = "."
+    else:
+        # Either there is no separator or it groups thousands
+        decimal_separator = ""
+    thousands_separator = {",": ".", ".": ",", "": ",."}[decimal_separator]
+    for separator in thousands_separator:
+        digits = digits.replace(separator, "")
+    digits = digits.replace(",", ".")
+    try:
+        return Decimal(digits)
+    except InvalidOperation:
+        return None
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_value(text: str) -> Decimal | None:
+    """Parses a text that contains a single number, possibly with a currency, a unit
+    or a magnitude suffix, like ``7,1M €``, ``1.36x``, ``41%`` or ``14 meses``.
+
+    Accounting negatives in parentheses are supported. Texts that contain anything
+    else return `None`. Results are cached, since bulk imports repeat a lot of values.
+
+    """
+    text = re.sub(r"[*_`]", "", text).strip()
+    negative = text.startswith("(") and text.endswith(")")
+    if negative:
+        text = text[1:-1].strip()
+    match = _VALUE_PATTERN.match(text)
+    if match is None:
+        return None
+    number = parse_number(match["number"])
+    if number is None:
+        return None
+    suffix = (match["suffix"] or "").lower()
+    number *= _SUFFIX_MULTIPLIERS.get(suffix, Decimal(1))
+    return -number if negative or match["sign"] else number
+
+
+@functools.cache
+def field_kinds(schema: type[BaseModel] = FormData) -> dict[str, FieldKind]:
+    """Maps each numeric field of a model to the type its values are coerced to."""
+    kinds: dict[str, FieldKind] = {}
+    for name, info in schema.model_fields.items():
+        types = get_args(info.annotation) or (info.annotation,)
+        if int in types:
+            kinds[name] = "int"
+        elif float in types:
+            kinds[name] = "float"
+        elif Decimal in types:
+            kinds[name] = "decimal"
+    return kinds
+
+
+def coerce_value(value: Any, kind: FieldKind) -> int | float | Decimal | None:
+    """Converts a value, as found in a document or returned by the LLM, to a field
+    type.
+
+    Raises a `ValueError` if the value isn't a number or, for integer fields, if it
+    has a fractional part. Missing values, like ``n/a``, are `None`.
+
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{value!r} isn't a number")
+    if isinstance(value, (int, float, Decimal)):
+        number = Decimal(str(value)) if isinstance(value, float) else Decimal(value)
+    elif isinstance(value, str):
+        if value.strip().lower() in _MISSING_VALUES:
+            return None
+        parsed = parse_value(value)
+        if parsed is None:
+            raise ValueError(f"{value!r} isn't a number")
+        number = parsed
+    else:
+        raise ValueError(f"{value!r} isn't a number")
+    if not number.is_finite():
+        raise ValueError(f"{value!r} isn't a finite number")
+    if kind == "int":
+        if number != number.to_integral_value():
+            raise ValueError(f"{value!r} isn't an integer")
+        return int(number)
+    if kind == "float":
+        return float(number)
+    return number
+
+
+def normalize_fields(
+    data: Mapping[str, Any],
+    schema: type[BaseModel] = FormData,
+    errors: dict[str, str] | None = None,
+) -> dict[str, Any]:
+    """Coerces the values of an extraction to the types of the fields of ``schema``.
+
+    Values that can't be coerced are logged and dropped, so that a single bad field
+    doesn't fail the whole extraction, and the reason is added to ``errors`` if
+    given. Unknown keys are dropped as well.
+
+    """
+    kinds = field_kinds(schema)
+    normalized: dict[str, Any] = {}
+    for name, value in data.items():
+        if name not in schema.model_fields:
+            continue
+        kind = kinds.get(name)
+        if kind is None:
+            normalized[name] = value
+            continue
+        try:
+            normalized[name] = coerce_value(value, kind)
+        except ValueError as e:
+            logger.warning(f"Discarding the value of '{name}': {e}.")
+            normalized[name] = None
+            if errors is not None:
+                errors[name] = str(e)
+    return normalized
+
+
+def normalize_json(
+    text: str,
+    schema: type[BaseModel] = FormData,
+    errors: dict[str, str] | None = None,
+) -> dict[str, Any]:
+    """Parses the JSON object returned by the LLM and normalizes its values."""
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object, got {type(data).__name__}.")
+    return normalize_fields(data, schema, errors)
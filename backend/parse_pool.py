@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, TypeVar
+
+from loguru import logger
+
+from .monitoring import (
+    PARSE_POOL_IN_FLIGHT,
+    PARSE_POOL_INPUT_BYTES,
+    PARSE_POOL_RESTARTS,
+    PARSE_POOL_TASK_SECONDS,
+    PARSE_POOL_TASKS,
+)
+
+T = TypeVar("T")
+
+
+class ParsePool:
+    """Runs the CPU-bound parsing stages, like reading workbooks, in worker processes.
+
+    In the API process they would hold the GIL and stall the event loop for every
+    other request. The tasks take and return plain bytes and strings, which are cheap
+    to pickle, instead of workbooks or DataFrames. Each worker is replaced after
+    ``max_tasks_per_child`` tasks, so that memory fragmented by large files is given
+    back to the OS. With ``processes=0`` the tasks run in a thread instead.
+
+    The pool is started on first use. A pool broken by a crashed worker is replaced,
+    and the task that was running fails.
+
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        max_tasks_per_child: int | None = 100,
+        start_method: str = "forkserver",
+    ) -> None:
+        self.processes = processes
+        self.max_tasks_per_child = max_tasks_per_child
+        self.start_method = start_method
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ParsePool":
+        """Builds the pool from the ``PARSE_PROCESSES``, ``PARSE_MAX_TASKS_PER_CHILD``
+        and ``PARSE_START_METHOD`` environment variables."""
+        max_tasks_per_child = int(os.getenv("PARSE_MAX_TASKS_PER_CHILD", "100"))
+        return cls(
+            processes=int(os.getenv("PARSE_PROCESSES", str(os.cpu_count() or 1))),
+            max_tasks_per_child=max_tasks_per_child
+            if max_tasks_per_child > 0
+            else None,
+            start_method=os.getenv("PARSE_START_METHOD", "forkserver"),
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Workers can't be recycled with `fork`, and forking a process that
+                # runs threads isn't safe anyway
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == "forkserver":
+                    # The server imports the parsers once, then each worker is
+                    # forked from it ready to go. They live outside of the backend
+                    # package, whose import would start the whole app
+                    context.set_forkserver_preload(
+                        ["parsing.spreadsheet", "parsing.mail"]
+                    )
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=context,
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+                logger.info(f"Started {self.processes} parsing processes.")
+            return self._executor
+
+    def _replace_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+                PARSE_POOL_RESTARTS.inc()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable[..., T], data: bytes, *args: object) -> T:
+        """Runs ``func(data, *args)`` in a worker process."""
+        task = func.__name__
+        PARSE_POOL_INPUT_BYTES.labels(task).inc(len(data))
+        start = time.perf_counter()
+        outcome = "error"
+        with PARSE_POOL_IN_FLIGHT.track_inprogress():
+            try:
+                if self.processes <= 0:
+                    result = await asyncio.to_thread(func, data, *args)
+                else:
+                    executor = self._get_executor()
+                    loop = asyncio.get_running_loop()
+                    try:
+                        result = await loop.run_in_executor(executor, func, data, *args)
+                    except BrokenProcessPool:
+                        logger.error("A parsing process died, restarting the pool.")
+                        self._replace_executor(executor)
+                        raise
+                outcome = "ok"
+                return result
+            finally:
+                PARSE_POOL_TASKS.labels(task, outcome).inc()
+                PARSE_POOL_TASK_SECONDS.labels(task).observe(
+                    time.perf_counter() - start
+                )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
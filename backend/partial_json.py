@@ -0,0 +1,70 @@
+import json
+from typing import Any
+
+
+class PartialObjectParser:
+    """Incrementally parses a JSON object that arrives in pieces, e.g. from a streamed
+    LLM response.
+
+    Every time a top-level member is complete, that is when the ``,`` or ``}`` that
+    follows its value arrives, it is returned by `feed`. Nested values are supported,
+    and anything before the opening brace, like a Markdown code fence, is ignored.
+
+    """
+
+    def __init__(self) -> None:
+        self._buffer: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self._finished = False
+
+    def feed(self, text: str) -> list[tuple[str, Any]]:
+        """Consumes the next piece of the document and returns the members that it
+        completes."""
+        members: list[tuple[str, Any]] = []
+        for char in text:
+            if self._finished:
+                break
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+            if self._in_string:
+                self._buffer.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+            if (self._depth == 1 and char == ",") or self._depth == 0:
+                member = self._parse_member("".join(self._buffer))
+                if member is not None:
+                    members.append(member)
+                self._buffer = []
+                self._finished = self._depth == 0
+                continue
+            self._buffer.append(char)
+        return members
+
+    @staticmethod
+    def _parse_member(text: str) -> tuple[str, Any] | None:
+        if text.strip() == "":
+            return None
+        try:
+            parsed = json.loads("{" + text + "}")
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(parsed, dict) or len(parsed) != 1:
+            return None
+        return next(iter(parsed.items()))
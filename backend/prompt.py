@@ -0,0 +1,107 @@
+import functools
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+from pydantic import BaseModel
+
+from commons import FormData
+
+TEMPLATE_PATH = Path(__file__).resolve().parent / "template.txt"
+"""The default prompt template, next to this module so that it doesn't depend on the
+working directory."""
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """A prompt template in which everything but the document has been filled in.
+
+    The instructions and the schema come before the document, so that every prompt
+    starts with the same `prefix` and providers can reuse their cached computation of
+    it. Only the document and the short list of requested fields vary, at the end.
+
+    """
+
+    prefix: str
+    suffix: str
+    fields: tuple[str, ...]
+    full_json_structure: str
+    """The JSON skeleton with all the fields, which is requested most often."""
+
+    def render(self, content: str, fields: list[str] | None = None) -> str:
+        """Fills in the document and the fields to extract, by default all of them."""
+        if fields is None or tuple(fields) == self.fields:
+            json_structure = self.full_json_structure
+        else:
+            json_structure = _json_structure(fields)
+        suffix = self.suffix.replace("{json_structure}", json_structure)
+        return self.prefix + content + suffix
+
+
+def _json_structure(fields: Iterable[str]) -> str:
+    return json.dumps({field_name: None for field_name in fields}, indent=2)
+
+
+def describe_schema(
+    schema: type[BaseModel], fields: Iterable[str] | None = None
+) -> str:
+    """Lists the fields of a model, by default all of them, with their descriptions,
+    one per line."""
+    return "\n".join(
+        f"- {name}: {info.description or name.replace('_', ' ')}"
+        for name, info in schema.model_fields.items()
+        if fields is None or name in fields
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def compile_prompt(template: str, schema: type[BaseModel] = FormData) -> CompiledPrompt:
+    """Compiles a template with the ``{schema}``, ``{content}`` and ``{json_structure}``
+    placeholders.
+
+    Compilations are cached by template and schema, so changing either of them yields
+    a new compiled prompt while repeated calls are free.
+
+    """
+    prefix, separator, suffix = template.partition("{content}")
+    if separator == "":
+        raise ValueError("The prompt template has no '{content}' placeholder.")
+    prefix = prefix.replace("{schema}", describe_schema(schema))
+    fields = tuple(schema.model_fields)
+    return CompiledPrompt(prefix, suffix, fields, _json_structure(fields))
+
+
+class _TemplateFiles:
+    """Caches the contents of the template files, reloading them when they change."""
+
+    def __init__(self) -> None:
+        self._contents: dict[Path, tuple[int, str]] = {}
+        self._lock = threading.Lock()
+
+    def read(self, path: Path) -> str:
+        # A stat is much cheaper than reading the file on every request
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._contents.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        text = path.read_text(encoding="utf-8")
+        with self._lock:
+            self._contents[path] = (mtime, text)
+        return text
+
+
+_template_files = _TemplateFiles()
+
+
+def load_prompt_template(template_path: str | Path = TEMPLATE_PATH) -> str:
+    """Loads the template text file.
+
+    The file is only read again when it's modified, so edits are picked up without
+    restarting the server.
+
+    """
+    return _template_files.read(Path(template_path).resolve())
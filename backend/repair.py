@@ -0,0 +1,107 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Iterable, Mapping
+
+from openai.types.shared_params import ResponseFormatJSONSchema
+
+from commons import FormData
+
+from .compaction import compact_document, mentioned_fields
+from .normalization import field_kinds, normalize_json
+from .prompt import describe_schema
+
+REPAIR_TOKEN_BUDGET = int(os.getenv("REPAIR_TOKEN_BUDGET", "400"))
+"""Maximum number of document tokens sent to the LLM by a repair."""
+REPAIR_MAX_FIELDS = int(os.getenv("REPAIR_MAX_FIELDS", "8"))
+"""Maximum number of fields repaired per extraction. Non-positive values disable the
+repairs."""
+
+_REPAIR_INSTRUCTIONS = """\
+A first pass over a document couldn't extract some financial and business metrics.
+Extract only the fields below from the excerpt of the document, as plain numbers in
+the unit of the field, without currencies, units or thousands separators. Set a field
+to null if the excerpt doesn't state it.
+
+Fields to extract, with their definitions:
+{schema}
+
+Excerpt of the document:
+{content}"""
+
+_JSON_TYPES = {"int": "integer", "float": "number", "decimal": "number"}
+
+
+@dataclass
+class RepairRequest:
+    """A follow-up LLM call that extracts a few fields from an excerpt of a document."""
+
+    fields: list[str]
+    prompt: str
+    response_format: ResponseFormatJSONSchema
+
+
+def fields_to_repair(
+    content: str, metrics: Mapping[str, Any], invalid: Iterable[str]
+) -> list[str]:
+    """Picks the fields worth asking the LLM for again.
+
+    These are the fields whose extracted value was invalid, and the missing fields
+    that the document seems to state, i.e. whose synonyms appear next to a number.
+    At most `REPAIR_MAX_FIELDS` fields are returned, the invalid ones first.
+
+    """
+    if REPAIR_MAX_FIELDS <= 0:
+        return []
+    missing = [
+        name
+        for name in FormData.model_fields
+        if metrics.get(name) is None and name not in invalid
+    ]
+    candidates = [name for name in FormData.model_fields if name in invalid]
+    candidates += mentioned_fields(content, missing)
+    return candidates[:REPAIR_MAX_FIELDS]
+
+
+def json_schema(fields: list[str]) -> ResponseFormatJSONSchema:
+    """Builds a strict JSON schema with a nullable number for each field."""
+    kinds = field_kinds(FormData)
+    properties = {
+        name: {
+            "type": [_JSON_TYPES[kinds[name]], "null"],
+            "description": FormData.model_fields[name].description or name,
+        }
+        for name in fields
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "repaired_fields",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": fields,
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def build_repair_request(content: str, fields: list[str]) -> RepairRequest:
+    """Builds the prompt for the given fields, with the document compacted to the
+    excerpt most relevant to them."""
+    excerpt = compact_document(content, fields, REPAIR_TOKEN_BUDGET).text
+    prompt = _REPAIR_INSTRUCTIONS.format(
+        schema=describe_schema(FormData, fields), content=excerpt
+    )
+    return RepairRequest(fields, prompt, json_schema(fields))
+
+
+def parse_repair_response(request: RepairRequest, text: str) -> dict[str, Any]:
+    """Returns the repaired fields that have a valid value."""
+    repaired = normalize_json(text)
+    return {
+        name: value
+        for name, value in repaired.items()
+        if name in request.fields and value is not None
+    }
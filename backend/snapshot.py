@@ -0,0 +1,181 @@
+import os
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Literal, Sequence, cast
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from commons import SubmissionState
+
+from .db import Report
+from .export import arrow_schema, reports_to_table
+
+SnapshotFormat = Literal["arrow", "parquet"]
+
+SNAPSHOT_MEDIA_TYPES: dict[SnapshotFormat, str] = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_PART_PATTERN = re.compile(r"^part-(\d{6})\.arrow$")
+
+
+def _versions(table: pa.Table) -> dict[str, datetime]:
+    """Maps the ids of the reports of a table to their last update time."""
+    ids = cast(list[str], table.column("id").to_pylist())
+    updated_at = cast(list[datetime], table.column("updated_at").to_pylist())
+    return dict(zip(ids, updated_at))
+
+
+class ColumnarSnapshot:
+    """Columnar copy of the finalized reports, in Arrow IPC files that can be memory
+    mapped.
+
+    Every change to a finalized report is appended to the snapshot as a new part file,
+    so finalizing a report costs a small write regardless of the size of the snapshot.
+    Once there are more than ``max_parts`` parts, they are compacted into one. When a
+    report is stored several times, its last version wins, and a finalized report that
+    goes back to being a draft is dropped.
+
+    The snapshot is derived from the `ReportStore`, as one of its listeners: it catches
+    up with the store when it's opened, so it doesn't need to be durable on its own.
+
+    """
+
+    def __init__(self, snapshot_dir: Path, max_parts: int = 32) -> None:
+        self.snapshot_dir = snapshot_dir
+        self.max_parts = max_parts
+        self._schema = arrow_schema()
+        self._pending: list[Report] = []
+        self._live = False
+        self._lock = threading.RLock()
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        self._versions = _versions(self._read_parts(["id", "updated_at"]))
+        """Maps the ids of the reports in the snapshot to their last update time."""
+
+    @classmethod
+    def from_env(cls) -> "ColumnarSnapshot":
+        """Builds the snapshot from the ``SNAPSHOT_DIR`` and ``SNAPSHOT_MAX_PARTS``
+        environment variables."""
+        default_dir = Path(os.getenv("DB_DIR", "db")) / "columnar"
+        return cls(
+            snapshot_dir=Path(os.getenv("SNAPSHOT_DIR", default_dir)),
+            max_parts=int(os.getenv("SNAPSHOT_MAX_PARTS", "32")),
+        )
+
+    def _part_paths(self) -> list[Path]:
+        return sorted(
+            path
+            for path in self.snapshot_dir.iterdir()
+            if _PART_PATTERN.match(path.name)
+        )
+
+    def _read_parts(self, columns: Sequence[str] | None = None) -> pa.Table:
+        """Reads all the rows of the parts, memory mapped, oldest first."""
+        tables = []
+        for path in self._part_paths():
+            with pa.memory_map(str(path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            tables.append(table if columns is None else table.select(columns))
+        if len(tables) == 0:
+            schema = self._schema
+            if columns is not None:
+                schema = pa.schema([schema.field(name) for name in columns])
+            return schema.empty_table()
+        return pa.concat_tables(tables)
+
+    def _write_part(self, table: pa.Table) -> None:
+        paths = self._part_paths()
+        number = 1 if len(paths) == 0 else int(paths[-1].name[5:11]) + 1
+        path = self.snapshot_dir / f"part-{number:06d}.arrow"
+        tmp_path = path.with_suffix(".tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, self._schema) as writer:
+                writer.write_table(table)
+        tmp_path.replace(path)
+
+    def update(self, report: Report) -> None:
+        """Records a report that has just been stored, if it's finalized or it was."""
+        with self._lock:
+            version = self._versions.get(report.id)
+            if version is not None and report.updated_at <= version:
+                # Already in the snapshot, e.g. when the store replays its journal
+                return
+            if (
+                report.state != SubmissionState.FINALIZED
+                and report.id not in self._versions
+            ):
+                return
+            self._versions[report.id] = report.updated_at
+            self._pending.append(report)
+            if self._live:
+                self.flush()
+
+    def open(self) -> None:
+        """Writes what was recorded while the store was being opened, then starts
+        writing every change as soon as it's recorded."""
+        with self._lock:
+            self.flush()
+            self._live = True
+
+    def flush(self) -> None:
+        """Writes the pending changes as a new part, compacting the parts if needed."""
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+            self._write_part(reports_to_table(self._pending, self._schema))
+            self._pending.clear()
+            if len(self._part_paths()) > self.max_parts:
+                self.compact()
+
+    def compact(self) -> None:
+        """Rewrites all the parts as a single one with only the finalized reports."""
+        with self._lock:
+            paths = self._part_paths()
+            table = self._latest(self._read_parts())
+            self._write_part(table)
+            for path in paths:
+                path.unlink()
+            self._versions = _versions(table)
+
+    @staticmethod
+    def _latest(table: pa.Table) -> pa.Table:
+        """Keeps the last version of each report, if it's finalized."""
+        rows = table.append_column("_row", pa.array(np.arange(len(table))))
+        last_rows = rows.group_by("id").aggregate([("_row", "max")])
+        table = table.take(np.sort(last_rows.column("_row_max").to_numpy()))
+        return table.filter(
+            pc.equal(table.column("state"), pa.scalar(SubmissionState.FINALIZED.value))
+        )
+
+    def read(self, columns: Sequence[str] | None = None) -> pa.Table:
+        """Returns the finalized reports, with only the given columns if any.
+
+        The parts are memory mapped, so the columns that aren't requested are never
+        read from disk.
+
+        """
+        needed = None
+        if columns is not None:
+            needed = list(dict.fromkeys(["id", "state", *columns]))
+        with self._lock:
+            self.flush()
+            table = self._read_parts(needed)
+        table = self._latest(table)
+        return table if columns is None else table.select(columns)
+
+
+def serialize_table(table: pa.Table, file_format: SnapshotFormat) -> bytes:
+    """Serializes a table as an Arrow IPC stream or as a Parquet file."""
+    sink = pa.BufferOutputStream()
+    if file_format == "parquet":
+        pq.write_table(table, sink, compression="zstd")
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,288 @@
+import re
+import unicodedata
+
+FIELD_SYNONYMS: dict[str, tuple[str, ...]] = {
+    "arr": (
+        "arr",
+        "annual recurring revenue",
+        "ingresos recurrentes anuales",
+        "ingreso recurrente anual",
+    ),
+    "number_of_clients": (
+        "number of clients",
+        "clients",
+        "total clients",
+        "customers",
+        "number of customers",
+        "total customers",
+        "clientes",
+        "clientes totales",
+        "clientes activos",
+        "numero de clientes",
+    ),
+    "leads_generated": (
+        "leads generated",
+        "leads",
+        "new leads",
+        "leads generados",
+        "leads nuevos",
+        "nuevos leads",
+    ),
+    "revenue": (
+        "revenue (ltm)",
+        "ltm revenue",
+        "revenue ltm",
+        "revenue last 12 months",
+        "revenue (last 12 months)",
+        "ingresos (ltm)",
+        "ingresos ltm",
+        "ingresos ultimos 12 meses",
+        "ingresos (ultimos 12 meses)",
+        "facturacion (ltm)",
+        "facturacion ultimos 12 meses",
+    ),
+    "ebitda": (
+        "ebitda",
+        "ebitda (ltm)",
+        "ebitda ltm",
+        "ebitda last 12 months",
+        "ebitda ultimos 12 meses",
+    ),
+    "ebit": (
+        "ebit",
+        "ebit (ltm)",
+        "ebit ltm",
+        "ebit last 12 months",
+        "ebit ultimos 12 meses",
+    ),
+    "corporate_tax": (
+        "corporate tax",
+        "corporate tax (ltm)",
+        "corporate tax ltm",
+        "impuesto de sociedades",
+        "impuesto de sociedades (ltm)",
+        "impuesto sobre sociedades",
+        "impuesto sobre sociedades (ltm)",
+    ),
+    "total_assets": ("total assets", "activos totales", "activo total"),
+    "intangible_assets": (
+        "intangible assets",
+        "intangibles",
+        "activos intangibles",
+        "inmovilizado intangible",
+    ),
+    "debt": ("debt", "total debt", "deuda", "deuda total", "deuda financiera"),
+    "debt_to_ebitda": (
+        "debt/ebitda",
+        "debt to ebitda",
+        "debt-to-ebitda",
+        "deuda/ebitda",
+        "ratio deuda/ebitda",
+        "net debt/ebitda",
+    ),
+    "percent_international_sales": (
+        "% international sales",
+        "international sales",
+        "international sales %",
+        "international sales (%)",
+        "% ventas internacionales",
+        "ventas internacionales",
+        "ventas internacionales (%)",
+    ),
+    "number_of_employees": (
+        "number of employees",
+        "employees",
+        "headcount",
+        "fte",
+        "empleados",
+        "numero de empleados",
+        "plantilla",
+        "plantilla total",
+    ),
+    "number_of_female_employees": (
+        "number of female employees",
+        "female employees",
+        "women employees",
+        "mujeres en plantilla",
+        "empleadas",
+        "numero de empleadas",
+        "mujeres empleadas",
+    ),
+    "number_of_c_level_executives": (
+        "number of c-level executives",
+        "c-level executives",
+        "c-levels",
+        "c-level",
+        "executives",
+        "numero de c-levels",
+        "directivos c-level",
+    ),
+    "number_of_female_c_level_executives": (
+        "number of female c-level executives",
+        "female c-level executives",
+        "female c-levels",
+        "mujeres en c-levels",
+        "mujeres c-level",
+        "mujeres en c-level",
+    ),
+    "number_of_board_members": (
+        "number of board members",
+        "board members",
+        "board",
+        "miembros del consejo",
+        "consejeros",
+        "miembros del consejo de administracion",
+    ),
+    "number_of_female_board_members": (
+        "number of female board members",
+        "female board members",
+        "women on the board",
+        "mujeres en el consejo",
+        "consejeras",
+    ),
+    "monthly_burn": (
+        "monthly burn",
+        "burn rate",
+        "monthly burn rate",
+        "burn",
+        "burn mensual",
+        "quema mensual",
+        "consumo de caja mensual",
+    ),
+    "runway_months": (
+        "runway",
+        "runway (months)",
+        "runway months",
+        "cash runway",
+        "runway (meses)",
+        "meses de runway",
+    ),
+    "gross_margin_percent": (
+        "gross margin",
+        "gross margin %",
+        "gross margin (%)",
+        "margen bruto",
+        "margen bruto %",
+        "margen bruto (%)",
+    ),
+    "annual_logo_churn_percent": (
+        "annual logo churn",
+        "annual logo churn %",
+        "logo churn",
+        "customer churn",
+        "churn anual de clientes",
+        "churn de clientes",
+    ),
+    "annual_revenue_churn_percent": (
+        "annual revenue churn",
+        "annual revenue churn %",
+        "revenue churn",
+        "churn anual de ingresos",
+        "churn de ingresos",
+    ),
+    "net_revenue_retention_percent": (
+        "net revenue retention",
+        "net revenue retention %",
+        "nrr",
+        "retencion neta de ingresos",
+        "retencion neta de ingresos (nrr)",
+    ),
+    "average_acv": (
+        "average acv",
+        "acv",
+        "average annual contract value",
+        "acv medio",
+        "acv promedio",
+        "valor medio de contrato anual",
+    ),
+    "payback_months": (
+        "payback",
+        "payback (months)",
+        "cac payback",
+        "payback months",
+        "payback sobre cac",
+        "payback (meses)",
+    ),
+    "sales_and_marketing_expenses_percent_of_revenue": (
+        "sales & marketing expenses % of revenue",
+        "sales and marketing expenses % of revenue",
+        "s&m % of revenue",
+        "sales & marketing",
+        "% ingresos en ventas & marketing",
+        "% ingresos en ventas y marketing",
+        "ventas y marketing",
+        "gastos de ventas y marketing",
+    ),
+    "general_and_administration_expenses_percent_of_revenue": (
+        "g&a expenses % of revenue",
+        "general & administration expenses % of revenue",
+        "general and administration expenses % of revenue",
+        "g&a % of revenue",
+        "g&a",
+        "% ingresos en administracion y generales",
+        "administracion y generales",
+        "gastos generales y de administracion",
+    ),
+    "research_and_development_expenses_percent_of_revenue": (
+        "r&d expenses % of revenue",
+        "research & development expenses % of revenue",
+        "research and development expenses % of revenue",
+        "r&d % of revenue",
+        "r&d",
+        "% ingresos en i+d",
+        "i+d",
+        "gastos de i+d",
+    ),
+}
+"""Maps each `FormData` field to the labels that identify it in English and Spanish.
+
+The labels are stored in the form returned by `normalize_label`. Ambiguous labels, like
+a bare "revenue" that could refer to a single quarter, are left out on purpose: those
+rows are better handled by the LLM.
+
+"""
+
+
+def normalize_label(label: str) -> str:
+    """Normalizes a row label so that it can be looked up in `FIELD_SYNONYMS`.
+
+    Accents, Markdown emphasis, trailing colons and redundant whitespace are removed
+    and the text is lowercased.
+
+    """
+    decomposed = unicodedata.normalize("NFKD", label)
+    text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    text = re.sub(r"[*_`#]", "", text).lower()
+    text = re.sub(r"\s*/\s*", "/", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip().rstrip(":").strip()
+
+
+SYNONYM_TO_FIELD: dict[str, str] = {
+    synonym: field_name
+    for field_name, synonyms in FIELD_SYNONYMS.items()
+    for synonym in synonyms
+}
+"""Reverse index of `FIELD_SYNONYMS`."""
+
+
+_PERIOD_QUALIFIER = re.compile(r"\bq[1-4]\b|quarter|trimestr|qtd|ytd|monthly|mensual")
+
+
+def match_field(label: str) -> str | None:
+    """Returns the `FormData` field that a row label refers to, if any.
+
+    The label is first looked up as is, then without its parenthesized qualifiers, so
+    that "Runway (months)" and "Retención neta de ingresos (NRR)" are both recognized.
+
+    """
+    normalized = normalize_label(label)
+    field_name = SYNONYM_TO_FIELD.get(normalized)
+    if field_name is not None:
+        return field_name
+    qualifiers = " ".join(re.findall(r"\(([^)]*)\)", normalized))
+    if qualifiers == "" or _PERIOD_QUALIFIER.search(qualifiers):
+        # "Revenue (Q1 2025)" is a quarterly figure, not the LTM one we're after
+        return None
+    without_qualifiers = re.sub(r"\s*\([^)]*\)", "", normalized).strip()
+    return SYNONYM_TO_FIELD.get(without_qualifiers)
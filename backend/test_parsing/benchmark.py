@@ -0,0 +1,214 @@
+"""Benchmarks the extraction over the whole corpus against the golden outputs.
+
+All the documents are extracted concurrently, and every field is compared with the
+expected `FormData` stored in ``golden/``. The report, with the accuracy, the time
+spent in each stage and the token usage of every document, is written as JSON so that
+it can be compared across changes. Run it with::
+
+    uv run python -m backend.test_parsing.benchmark
+
+"""
+
+import argparse
+import asyncio
+import math
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel
+
+from commons import FormData
+
+from .. import file_to_metrics
+from ..cache import ExtractionCache
+from ..tracing import stage, trace_extraction
+
+BASE_DIR = Path(__file__).resolve().parent
+TEMPLATE_PATH = BASE_DIR.parent / "template.txt"
+GOLDEN_DIR = BASE_DIR / "golden"
+OUTPUT_DIR = BASE_DIR / "outputs"
+
+
+class FieldMismatch(BaseModel):
+    expected: Any
+    actual: Any
+
+
+class DocumentResult(BaseModel):
+    file_name: str
+    seconds: float
+    stages: dict[str, float] = {}
+    """The wall time of each stage, in seconds."""
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    correct: int = 0
+    """The fields whose value, or absence, matches the golden output."""
+    missing: int = 0
+    """The fields that should have been extracted but weren't."""
+    spurious: int = 0
+    """The fields that were extracted but are absent from the golden output."""
+    wrong: int = 0
+    mismatches: dict[str, FieldMismatch] = {}
+    error: str | None = None
+
+
+class BenchmarkReport(BaseModel):
+    model: str
+    seconds: float
+    """The wall time of the whole benchmark."""
+    accuracy: float
+    """The fraction of the fields of all documents that were extracted correctly."""
+    llm_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    stages: dict[str, float]
+    """The total time spent in each stage, summed over the documents."""
+    documents: list[DocumentResult]
+
+
+def _same_value(expected: Any, actual: Any) -> bool:
+    if isinstance(expected, float) or isinstance(actual, float):
+        return math.isclose(float(expected), float(actual), rel_tol=1e-6)
+    return expected == actual
+
+
+def compare(expected: FormData, actual: FormData, result: DocumentResult) -> None:
+    """Compares an extraction with its golden output, field by field."""
+    for name in FormData.model_fields:
+        expected_value = getattr(expected, name)
+        actual_value = getattr(actual, name)
+        if expected_value is None and actual_value is None:
+            result.correct += 1
+            continue
+        if expected_value is None:
+            result.spurious += 1
+        elif actual_value is None:
+            result.missing += 1
+        elif _same_value(expected_value, actual_value):
+            result.correct += 1
+            continue
+        else:
+            result.wrong += 1
+        result.mismatches[name] = FieldMismatch(
+            expected=expected_value, actual=actual_value
+        )
+
+
+async def benchmark_document(path: Path, template_text: str) -> DocumentResult:
+    """Extracts the metrics of a document, tracing each stage of the extraction."""
+    golden = FormData.model_validate_json(
+        (GOLDEN_DIR / f"{path.stem}.json").read_bytes()
+    )
+    start = time.perf_counter()
+    with trace_extraction() as trace:
+        try:
+            with stage("read"):
+                file_bytes = await asyncio.to_thread(path.read_bytes)
+            content_text = await file_to_metrics.file_to_text_async(
+                path.name, file_bytes
+            )
+            metrics = await file_to_metrics.extract_metrics_async(
+                content_text, template_text
+            )
+        except Exception as e:
+            metrics = None
+            error: str | None = f"{type(e).__name__}: {e}"
+        else:
+            error = None
+    result = DocumentResult(
+        file_name=path.name,
+        seconds=time.perf_counter() - start,
+        stages=trace.stages,
+        llm_calls=trace.llm_calls,
+        prompt_tokens=trace.prompt_tokens,
+        completion_tokens=trace.completion_tokens,
+        error=error,
+    )
+    if metrics is not None:
+        compare(golden, metrics, result)
+    return result
+
+
+async def run_benchmark(paths: list[Path]) -> BenchmarkReport:
+    template_text = TEMPLATE_PATH.read_text(encoding="utf-8")
+    start = time.perf_counter()
+    documents = await asyncio.gather(
+        *(benchmark_document(path, template_text) for path in paths)
+    )
+    stages: dict[str, float] = {}
+    for document in documents:
+        for name, seconds in document.stages.items():
+            stages[name] = stages.get(name, 0.0) + seconds
+    num_fields = len(FormData.model_fields) * len(documents)
+    return BenchmarkReport(
+        model=file_to_metrics.MODEL,
+        seconds=time.perf_counter() - start,
+        accuracy=sum(document.correct for document in documents) / num_fields,
+        llm_calls=sum(document.llm_calls for document in documents),
+        prompt_tokens=sum(document.prompt_tokens for document in documents),
+        completion_tokens=sum(document.completion_tokens for document in documents),
+        stages=stages,
+        documents=list(documents),
+    )
+
+
+def corpus_paths() -> list[Path]:
+    """Returns the documents that have a golden output."""
+    stems = {path.stem for path in GOLDEN_DIR.glob("*.json")}
+    return sorted(
+        path
+        for path in BASE_DIR.iterdir()
+        if path.suffix in (".txt", ".csv", ".xlsx", ".xls") and path.stem in stems
+    )
+
+
+def print_report(report: BenchmarkReport) -> None:
+    for document in report.documents:
+        num_fields = len(FormData.model_fields)
+        status = document.error or ", ".join(sorted(document.mismatches)) or "ok"
+        print(
+            f"{document.file_name:<24}{document.correct:>3}/{num_fields} "
+            f"{document.seconds:>7.2f}s {document.prompt_tokens:>6} tok  {status}"
+        )
+    print(
+        f"Accuracy {report.accuracy:.1%} in {report.seconds:.2f}s, "
+        f"{report.llm_calls} LLM calls, {report.prompt_tokens} prompt and "
+        f"{report.completion_tokens} completion tokens."
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Extraction benchmark.")
+    parser.add_argument(
+        "files", nargs="*", type=Path, help="Defaults to the whole corpus."
+    )
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        help="Serve the documents from the extraction cache, if they're in it.",
+    )
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR / "benchmark.json")
+    parser.add_argument(
+        "--min-accuracy",
+        type=float,
+        default=0.0,
+        help="Exit with an error if the accuracy is lower than this.",
+    )
+    args = parser.parse_args()
+    if not args.use_cache:
+        file_to_metrics.extraction_cache = ExtractionCache(Path(tempfile.mkdtemp()))
+    paths = [BASE_DIR / path.name for path in args.files] or corpus_paths()
+    report = asyncio.run(run_benchmark(paths))
+    print_report(report)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(report.model_dump_json(indent=2), encoding="utf-8")
+    if report.accuracy < args.min_accuracy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from loguru import logger
+from pydantic import BaseModel
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .monitoring import HTTP_REQUEST_SECONDS, observe_stage, record_tokens
+
+
+class ExtractionTrace(BaseModel):
+    """What an extraction spent its time and tokens on."""
+
+    stages: dict[str, float] = {}
+    """Maps each stage, like ``llm`` or ``validation``, to its total wall time, in
+    seconds."""
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+_current_trace: ContextVar[ExtractionTrace | None] = ContextVar(
+    "current_trace", default=None
+)
+
+
+@contextmanager
+def trace_extraction() -> Iterator[ExtractionTrace]:
+    """Collects the stage timings and the token usage of the code run in the block.
+
+    The trace is stored in a context variable, so it follows the asyncio tasks and the
+    threads started with `asyncio.to_thread` from within the block.
+
+    """
+    trace = ExtractionTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times a stage of the extraction.
+
+    The wall time is recorded in the ``extraction_stage_seconds`` histogram and added
+    to the current trace, if any. Stages that run more than once in a trace, like the
+    LLM calls of a chunked document, are summed up.
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe_stage(name, elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.stages[name] = trace.stages.get(name, 0.0) + elapsed
+
+
+def record_llm_usage(prompt_tokens: int, completion_tokens: int) -> None:
+    """Records the token usage of an LLM call, also in the current trace."""
+    record_tokens(prompt_tokens, completion_tokens)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.llm_calls += 1
+        trace.prompt_tokens += prompt_tokens
+        trace.completion_tokens += completion_tokens
+
+
+class RequestTracingMiddleware:
+    """Traces every request served by the API.
+
+    Each request gets a trace id, taken from the ``X-Request-ID`` header if the client
+    sent one, that is bound to its log lines and returned in the ``X-Trace-ID``
+    header. The time to serve the request is recorded in the ``http_request_seconds``
+    histogram and, for requests that ran an extraction, the time spent in each stage
+    is logged. Streamed responses are traced until their last byte is sent.
+
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace_id = uuid.uuid4().hex
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                trace_id = value.decode("latin-1")[:64]
+        status = 500
+
+        async def send_with_trace_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        start = time.perf_counter()
+        with logger.contextualize(trace_id=trace_id), trace_extraction() as trace:
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                elapsed = time.perf_counter() - start
+                route = scope.get("route")
+                path = getattr(route, "path", "unmatched")
+                HTTP_REQUEST_SECONDS.labels(scope["method"], path, status).observe(
+                    elapsed
+                )
+                if len(trace.stages) > 0:
+                    stages = ", ".join(
+                        f"{name} {1000 * seconds:.1f} ms"
+                        for name, seconds in trace.stages.items()
+                    )
+                    logger.info(
+                        f"{scope['method']} {path} served in "
+                        f"{1000 * elapsed:.1f} ms ({stages}), "
+                        f"{trace.prompt_tokens} prompt and "
+                        f"{trace.completion_tokens} completion tokens."
+                    )
@@ -0,0 +1,313 @@
+import os
+import threading
+from typing import Iterable, Literal
+
+import numpy as np
+from pydantic import BaseModel
+
+from commons import FormData
+
+from .aggregation import DERIVED_METRICS
+from .db import Report
+
+RUNWAY_ALERT_MONTHS = float(os.getenv("RUNWAY_ALERT_MONTHS", "12"))
+"""Reports with a shorter runway raise an alert."""
+CONSISTENCY_TOLERANCE = float(os.getenv("CONSISTENCY_TOLERANCE", "0.1"))
+"""The relative difference allowed between a reported ratio and the one computed from
+the reported values."""
+QOQ_MAX_CHANGE = float(os.getenv("QOQ_MAX_CHANGE", "3"))
+"""The factor a metric can grow or shrink by since the previous quarter before being
+flagged as an outlier."""
+
+METRICS: list[str] = list(FormData.model_fields)
+_COLUMNS = {metric: idx for idx, metric in enumerate(METRICS)}
+
+Severity = Literal["error", "warning", "alert"]
+"""``error``: the values contradict each other. ``warning``: a value is suspicious
+and should be double-checked. ``alert``: the values are plausible but are a red flag
+for the company."""
+
+
+class Finding(BaseModel):
+    """A problem found in the metrics of a report."""
+
+    rule: str
+    severity: Severity
+    fields: list[str]
+    """The fields involved, the first one being the most likely culprit."""
+    message: str
+
+
+class ReportValidation(BaseModel):
+    """The findings of a report."""
+
+    report_id: str
+    company_id: str | None
+    period: str | None
+    findings: list[Finding]
+
+
+def _format(value: float) -> str:
+    return f"{value:,.4g}"
+
+
+def _values(reports: list[Report]) -> np.ndarray:
+    """Stacks the metrics of the reports in a matrix, with NaN for missing values."""
+    values = np.full((len(reports), len(METRICS)), np.nan)
+    for row, report in enumerate(reports):
+        form_data = report.form_data
+        values[row] = [
+            np.nan if value is None else float(value)
+            for value in (getattr(form_data, metric) for metric in METRICS)
+        ]
+    return values
+
+
+def _previous_rows(reports: list[Report]) -> np.ndarray:
+    """Finds the report each report is compared to for the quarter-over-quarter
+    checks, i.e. the one of the same company for its previous reported period.
+
+    When a company has several reports for a period, the last updated one is used.
+    Returns the rows of the previous reports, -1 for the reports without one.
+
+    """
+    # Periods like 2025-Q1 sort chronologically as strings
+    order = sorted(
+        (
+            (report.company_id, report.period, report.updated_at, row)
+            for row, report in enumerate(reports)
+            if report.company_id is not None and report.period is not None
+        ),
+    )
+    previous_rows = np.full(len(reports), -1, dtype=np.int64)
+    company: str | None = None
+    period: str | None = None
+    reference = previous_reference = -1
+    for company_id, report_period, _, row in order:
+        if company_id != company:
+            company, period = company_id, report_period
+            reference = previous_reference = -1
+        elif report_period != period:
+            period = report_period
+            previous_reference = reference
+        previous_rows[row] = previous_reference
+        reference = row
+    return previous_rows
+
+
+def _findings(
+    reports: list[Report], values: np.ndarray, previous_rows: np.ndarray
+) -> list[list[Finding]]:
+    """Runs all the checks on the rows of ``values``, one rule at a time over all the
+    rows, and returns the findings of each report."""
+    findings: list[list[Finding]] = [[] for _ in reports]
+
+    def column(metric: str) -> np.ndarray:
+        return values[:, _COLUMNS[metric]]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        debt, ebitda, debt_to_ebitda = (
+            column("debt"),
+            column("ebitda"),
+            column("debt_to_ebitda"),
+        )
+        expected = debt / ebitda
+        mismatch = (ebitda != 0) & (
+            np.abs(debt_to_ebitda - expected) > CONSISTENCY_TOLERANCE * np.abs(expected)
+        )
+        for row in np.flatnonzero(mismatch):
+            findings[row].append(
+                Finding(
+                    rule="debt_to_ebitda_mismatch",
+                    severity="warning",
+                    fields=["debt_to_ebitda", "debt", "ebitda"],
+                    message=(
+                        f"debt_to_ebitda is {_format(debt_to_ebitda[row])}, but "
+                        f"debt / ebitda is {_format(expected[row])}."
+                    ),
+                )
+            )
+
+        for female, total in DERIVED_METRICS.values():
+            exceeding = column(female) > column(total)
+            for row in np.flatnonzero(exceeding):
+                findings[row].append(
+                    Finding(
+                        rule="female_count_exceeds_total",
+                        severity="error",
+                        fields=[female, total],
+                        message=(
+                            f"{female} ({_format(column(female)[row])}) is greater "
+                            f"than {total} ({_format(column(total)[row])})."
+                        ),
+                    )
+                )
+
+        # The CAC isn't reported, so the payback can only be checked to be
+        # recoverable, i.e. positive with a positive ACV and gross margin
+        payback = column("payback_months")
+        unrecoverable = ~np.isnan(payback) & (
+            (payback <= 0)
+            | (column("average_acv") <= 0)
+            | (column("gross_margin_percent") <= 0)
+        )
+        for row in np.flatnonzero(unrecoverable):
+            findings[row].append(
+                Finding(
+                    rule="payback_inconsistent",
+                    severity="error",
+                    fields=["payback_months", "average_acv", "gross_margin_percent"],
+                    message=(
+                        "payback_months must be positive, and the CAC can only be "
+                        "recovered with a positive average_acv and "
+                        "gross_margin_percent."
+                    ),
+                )
+            )
+
+        runway = column("runway_months")
+        for row in np.flatnonzero(runway < RUNWAY_ALERT_MONTHS):
+            findings[row].append(
+                Finding(
+                    rule="short_runway",
+                    severity="alert",
+                    fields=["runway_months"],
+                    message=(
+                        f"The runway is {_format(runway[row])} months, less than "
+                        f"{_format(RUNWAY_ALERT_MONTHS)}."
+                    ),
+                )
+            )
+
+        has_previous = previous_rows >= 0
+        previous = np.full_like(values, np.nan)
+        previous[has_previous] = values[previous_rows[has_previous]]
+        change = values / previous
+        outliers = (
+            (values > 0)
+            & (previous > 0)
+            & ((change > QOQ_MAX_CHANGE) | (change < 1 / QOQ_MAX_CHANGE))
+        )
+        for row, column_idx in zip(*np.nonzero(outliers)):
+            metric = METRICS[column_idx]
+            findings[row].append(
+                Finding(
+                    rule="qoq_outlier",
+                    severity="warning",
+                    fields=[metric],
+                    message=(
+                        f"{metric} went from {_format(previous[row, column_idx])} in "
+                        f"{reports[previous_rows[row]].period} to "
+                        f"{_format(values[row, column_idx])}."
+                    ),
+                )
+            )
+    return findings
+
+
+def validate_reports(reports: list[Report]) -> list[list[Finding]]:
+    """Validates many reports at once and returns the findings of each one.
+
+    The quarter-over-quarter checks compare each report to the previous one of its
+    company among the given reports, so all the reports of a company should be
+    validated together.
+
+    """
+    if len(reports) == 0:
+        return []
+    return _findings(reports, _values(reports), _previous_rows(reports))
+
+
+class ValidationIndex:
+    """Keeps the findings of all the reports up to date, as a listener of the
+    `ReportStore`.
+
+    A stored report is validated together with the other reports of its company, since
+    it can change the quarter-over-quarter findings of the next period. The reports
+    replayed while the store is being opened are validated all at once by `open`.
+
+    """
+
+    def __init__(self) -> None:
+        self._reports: dict[str, Report] = {}
+        self._companies: dict[str | None, dict[str, None]] = {}
+        """Maps each company to the ids of its reports."""
+        self._findings: dict[str, list[Finding]] = {}
+        self._live = False
+        self._lock = threading.Lock()
+
+    def _validate(self, reports: list[Report]) -> None:
+        for report, findings in zip(reports, validate_reports(reports)):
+            self._findings[report.id] = findings
+
+    def _company_reports(self, company_id: str | None) -> list[Report]:
+        ids = self._companies.get(company_id, {})
+        return [self._reports[report_id] for report_id in ids]
+
+    def update(self, report: Report) -> None:
+        """Revalidates the reports of the company of a report that has just been
+        stored."""
+        with self._lock:
+            previous = self._reports.get(report.id)
+            if previous is not None and previous.company_id != report.company_id:
+                del self._companies[previous.company_id][report.id]
+            self._reports[report.id] = report
+            self._companies.setdefault(report.company_id, {})[report.id] = None
+            if not self._live:
+                return
+            if report.company_id is None:
+                self._validate([report])
+            else:
+                self._validate(self._company_reports(report.company_id))
+            if previous is not None and previous.company_id != report.company_id:
+                self._validate(self._company_reports(previous.company_id))
+
+    def open(self) -> None:
+        """Validates all the reports recorded so far, then starts validating every
+        report as soon as it's stored."""
+        with self._lock:
+            self._validate(list(self._reports.values()))
+            self._live = True
+
+    @staticmethod
+    def _validation(report: Report, findings: list[Finding]) -> ReportValidation:
+        return ReportValidation(
+            report_id=report.id,
+            company_id=report.company_id,
+            period=report.period,
+            findings=findings,
+        )
+
+    def get(self, report_id: str) -> ReportValidation | None:
+        with self._lock:
+            findings = self._findings.get(report_id)
+            if findings is None:
+                return None
+            return self._validation(self._reports[report_id], findings)
+
+    def find(
+        self,
+        company_id: str | None = None,
+        period: str | None = None,
+        severities: list[Severity] | None = None,
+    ) -> list[ReportValidation]:
+        """Returns the reports with at least one finding of the given severities,
+        keeping only those findings."""
+        with self._lock:
+            if company_id is None:
+                ids: Iterable[str] = self._findings
+            else:
+                ids = self._companies.get(company_id, {})
+            results = []
+            for report_id in ids:
+                report = self._reports[report_id]
+                if period is not None and report.period != period:
+                    continue
+                findings = [
+                    finding
+                    for finding in self._findings.get(report_id, [])
+                    if severities is None or finding.severity in severities
+                ]
+                if len(findings) > 0:
+                    results.append(self._validation(report, findings))
+            return results
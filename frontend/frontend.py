@@ -1,18 +1,73 @@
-import json
-from typing import Any
+import contextlib
+import os
+from typing import Any, AsyncIterator
 
+import httpx
 import reflex as rx
-import requests
+from dotenv import load_dotenv
+from loguru import logger
 from commons import FormData, SubmissionState
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+
+load_dotenv()
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8001")
+"""The base URL of the API."""
+
+FIELD_DESCRIPTIONS: dict[str, str] = {
+    name: info.description or "" for name, info in FormData.model_fields.items()
+}
+"""The tooltip of each field, computed once from the `FormData` schema."""
+
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the client shared by all the sessions, so that the connections to the
+    backend are kept alive and reused."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            base_url=BACKEND_URL,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _http_client
+
+
+@contextlib.asynccontextmanager
+async def close_http_client() -> AsyncIterator[None]:
+    yield
+    if _http_client is not None:
+        await _http_client.aclose()
 
 
 app = rx.App()
+app.register_lifespan_task(close_http_client)
+
+
+def _draft_values(form_data: FormData | None) -> dict[str, str]:
+    """Formats the values of a draft as the default values of the inputs."""
+    if form_data is None:
+        return {}
+    return {
+        field_name: str(value)
+        for field_name, value in form_data.model_dump(exclude_none=True).items()
+    }
 
 
 class FormState(rx.State):
     form_data: dict[str, Any] = {}
     submission_state: SubmissionState = SubmissionState.FINALIZED
+    company_id: str = ""
+    """The company the report is submitted for."""
+    draft_report: dict[str, Any] = {}
+    """The draft of the company stored in the backend, which the submission updates
+    instead of adding another report."""
+    draft: dict[str, str] = {}
+    """The values of the draft of the company stored in the backend, used to pre-fill
+    the form."""
+    draft_loaded: bool = False
 
     @rx.event
     def set_submission_state(self, checked: bool) -> None:
@@ -22,27 +77,78 @@ class FormState(rx.State):
             self.submission_state = SubmissionState.DRAFT
 
     @rx.event
-    def handle_submit(self, form_data: dict[str, Any]) -> None:
+    def set_company_id(self, company_id: str):
+        company_id = company_id.strip()
+        if company_id != self.company_id:
+            self.company_id = company_id
+            return FormState.load_draft
+
+    @rx.event
+    async def load_draft(self):
+        """Fetches the current draft of the company, if any, and renders the form
+        pre-filled with it."""
+        self.draft_loaded = False
+        yield
+        report: dict[str, Any] = {}
+        draft: FormData | None = None
+        if self.company_id != "":
+            try:
+                response = await get_http_client().get(
+                    "/startup-report", params={"company_id": self.company_id}
+                )
+                response.raise_for_status()
+                body = response.json()
+                if body is not None:
+                    draft = FormData.model_validate(body["form_data"])
+                    report = body
+            except (httpx.HTTPError, ValidationError, KeyError) as e:
+                # The form can still be filled in by hand
+                logger.warning(f"Couldn't load the draft: {e}")
+        self.draft_report = report
+        self.draft = _draft_values(draft)
+        self.draft_loaded = True
+
+    @rx.event
+    async def handle_submit(self, form_data: dict[str, Any]):
+        if self.company_id == "":
+            yield rx.window_alert("Enter the company the report is for.")
+            return
         # Empty fields in an HTML form are modeled with an empty string, which has to be converted to `None`
         for field_name in form_data:
             value = form_data[field_name]
             if value == "":
                 form_data[field_name] = None
         parsed_form_data = FormData.parse_obj(form_data)
+        # The draft, if any, is updated in place. Its update time is set again by the
+        # backend
         obj = {
-            "form_data": parsed_form_data.model_dump(),
+            **{
+                key: value
+                for key, value in self.draft_report.items()
+                if key != "updated_at"
+            },
+            "company_id": self.company_id,
+            "form_data": parsed_form_data.model_dump(mode="json"),
             "state": self.submission_state.value,
         }
         try:
-            response = requests.post(
-                "http://127.0.0.1:8001/startup-report/", data=json.dumps(obj)
-            )
+            response = await get_http_client().post("/startup-report/", json=obj)
             if response.status_code != 200:
                 raise RuntimeError(
                     f"The server refused the submission. Status code: {response.status_code}, error message: {response.text}."
                 )
         except Exception as e:
             raise RuntimeError("Couldn't submit the form.") from e
+        # Render the form again, pre-filled with what is now the draft, if any
+        self.draft_loaded = False
+        yield
+        if self.submission_state == SubmissionState.DRAFT:
+            self.draft_report = response.json()
+            self.draft = _draft_values(parsed_form_data)
+        else:
+            self.draft_report = {}
+            self.draft = {}
+        self.draft_loaded = True
 
 
 class FormField(BaseModel):
@@ -70,16 +176,17 @@ class FormField(BaseModel):
                         name=self.field_name,
                         type=self.type,
                         placeholder=self.placeholder,
+                        default_value=FormState.draft[self.field_name],
                     ),
                     as_child=True,
                 ),
-                content=FormData.schema()["properties"][self.field_name]["description"],
+                content=FIELD_DESCRIPTIONS[self.field_name],
             ),
             key=self.field_name,
         )
 
 
-@app.add_page
+@app.add_page(on_load=FormState.load_draft)
 def index() -> rx.Component:
     form_fields = [
         FormField(
@@ -257,32 +364,51 @@ def index() -> rx.Component:
             label="R&D Expenses (% of Revenue)",
         ),
     ]
+    # The inputs take their default values when they are mounted, so the form is only
+    # rendered once the draft is known
     return rx.center(
-        rx.form.root(
-            rx.heading("Quarterly Metrics Update"),
-            list(map(lambda field: field.render(), form_fields)),
-            rx.flex(
-                rx.switch(
-                    checked=FormState.submission_state == SubmissionState.FINALIZED,
-                    on_change=FormState.set_submission_state,
-                ),
-                rx.cond(
-                    FormState.submission_state == SubmissionState.FINALIZED,
-                    rx.button("Submit", type="submit"),
-                    rx.button("Save Draft", type="submit"),
-                ),
-                flex_direction="row",
-                justify_content="flex-end",
-                align_items="center",
-                gap="15px",
+        rx.flex(
+            rx.input(
+                placeholder="Company",
+                default_value=FormState.company_id,
+                on_blur=FormState.set_company_id,
+            ),
+            rx.cond(
+                FormState.draft_loaded,
+                _form(form_fields),
+                rx.spinner(),
             ),
-            on_submit=FormState.handle_submit,
-            reset_on_submit=True,
-            max_width="500px",
-            height="100%",
             flex_direction="column",
-            align_content="center",
-            row_gap="100px",
+            row_gap="20px",
         ),
         height="100vh",
     )
+
+
+def _form(form_fields: list[FormField]) -> rx.Component:
+    return rx.form.root(
+        rx.heading("Quarterly Metrics Update"),
+        list(map(lambda field: field.render(), form_fields)),
+        rx.flex(
+            rx.switch(
+                checked=FormState.submission_state == SubmissionState.FINALIZED,
+                on_change=FormState.set_submission_state,
+            ),
+            rx.cond(
+                FormState.submission_state == SubmissionState.FINALIZED,
+                rx.button("Submit", type="submit"),
+                rx.button("Save Draft", type="submit"),
+            ),
+            flex_direction="row",
+            justify_content="flex-end",
+            align_items="center",
+            gap="15px",
+        ),
+        on_submit=FormState.handle_submit,
+        reset_on_submit=True,
+        max_width="500px",
+        height="100%",
+        flex_direction="column",
+        align_content="center",
+        row_gap="100px",
+    )
@@ -0,0 +1,221 @@
+"""Drives the backend at a target request rate and reports the latencies.
+
+Requests are started on a fixed schedule, whether or not the previous ones have
+completed, and their latencies are measured from their scheduled start. This way a
+slow server can't hide its queueing delay by slowing down the load generator. Run it
+against a backend that talks to `loadtest.mock_llm`::
+
+    uv run python -m loadtest.harness --url http://localhost:8001 --rps 20
+
+"""
+
+import argparse
+import asyncio
+import random
+import string
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import httpx
+from pydantic import BaseModel
+
+CORPUS_DIR = Path(__file__).resolve().parent.parent / "backend" / "test_parsing"
+
+
+class ScenarioStats(BaseModel):
+    """The outcome of the requests of a scenario."""
+
+    requests: int
+    errors: int
+    throughput: float
+    """Completed requests per second."""
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+class LoadTestReport(BaseModel):
+    target_rps: float
+    duration_seconds: float
+    scenarios: dict[str, ScenarioStats]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of some sorted values."""
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def load_corpus(corpus_dir: Path) -> list[tuple[str, bytes]]:
+    return [
+        (path.name, path.read_bytes())
+        for path in sorted(corpus_dir.iterdir())
+        if path.suffix in (".txt", ".csv", ".xlsx")
+    ]
+
+
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+def make_scenarios(
+    corpus: list[tuple[str, bytes]], companies: int, bust_cache: bool
+) -> dict[str, Scenario]:
+    """Builds the requests sent by the load test, by name."""
+
+    def company(request_idx: int) -> str:
+        return f"loadtest-{request_idx % companies}"
+
+    async def upload(client: httpx.AsyncClient, request_idx: int) -> httpx.Response:
+        file_name, file_bytes = corpus[request_idx % len(corpus)]
+        if bust_cache and not file_name.endswith(".xlsx"):
+            # The request number changes the numbers of the document as well, or the
+            # upload would be a near-duplicate of the previous one of the company
+            nonce = "".join(random.choices(string.ascii_letters, k=16))
+            file_bytes += f"\nReference: {nonce}-{request_idx}\n".encode()
+        return await client.post(
+            "/startup-report/file",
+            params={"company_id": company(request_idx), "period": "2025-Q1"},
+            files={"file": (file_name, file_bytes)},
+        )
+
+    async def list_reports(
+        client: httpx.AsyncClient, request_idx: int
+    ) -> httpx.Response:
+        return await client.get(
+            "/startup-reports", params={"company_id": company(request_idx)}
+        )
+
+    async def draft(client: httpx.AsyncClient, request_idx: int) -> httpx.Response:
+        return await client.get(
+            "/startup-report", params={"company_id": company(request_idx)}
+        )
+
+    async def aggregates(client: httpx.AsyncClient, request_idx: int) -> httpx.Response:
+        return await client.get(
+            "/portfolio/aggregates",
+            params={"group_by": "period", "stats": ["median", "p90"]},
+        )
+
+    return {
+        "upload": upload,
+        "list_reports": list_reports,
+        "draft": draft,
+        "aggregates": aggregates,
+    }
+
+
+async def run_load_test(
+    url: str,
+    rps: float,
+    duration: float,
+    upload_share: float,
+    corpus: list[tuple[str, bytes]],
+    companies: int = 20,
+    bust_cache: bool = True,
+    timeout: float = 120,
+) -> LoadTestReport:
+    """Sends ``rps`` requests per second for ``duration`` seconds.
+
+    A share ``upload_share`` of the requests are uploads of the corpus documents, the
+    rest are spread evenly over the query endpoints.
+
+    """
+    scenarios = make_scenarios(corpus, companies, bust_cache)
+    queries = [name for name in scenarios if name != "upload"]
+    latencies: defaultdict[str, list[float]] = defaultdict(list)
+    errors: defaultdict[str, int] = defaultdict(int)
+    rng = random.Random(0)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(
+        base_url=url, timeout=timeout, limits=limits
+    ) as client:
+
+        async def send(name: str, request_idx: int, scheduled: float) -> None:
+            try:
+                response = await scenarios[name](client, request_idx)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append(time.perf_counter() - scheduled)
+            if failed:
+                errors[name] += 1
+
+        tasks: list[asyncio.Task[None]] = []
+        start = time.perf_counter()
+        total = int(rps * duration)
+        for request_idx in range(total):
+            scheduled = start + request_idx / rps
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            name = "upload" if rng.random() < upload_share else rng.choice(queries)
+            tasks.append(asyncio.create_task(send(name, request_idx, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    stats: dict[str, ScenarioStats] = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        stats[name] = ScenarioStats(
+            requests=len(values),
+            errors=errors[name],
+            throughput=len(values) / elapsed,
+            p50_ms=1000 * percentile(values, 0.5),
+            p95_ms=1000 * percentile(values, 0.95),
+            p99_ms=1000 * percentile(values, 0.99),
+            max_ms=1000 * values[-1],
+        )
+    return LoadTestReport(target_rps=rps, duration_seconds=elapsed, scenarios=stats)
+
+
+def print_report(report: LoadTestReport) -> None:
+    print(
+        f"Target: {report.target_rps:g} req/s for {report.duration_seconds:.1f}s\n"
+        f"{'scenario':<14}{'requests':>9}{'errors':>8}{'req/s':>8}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    )
+    for name, stats in report.scenarios.items():
+        print(
+            f"{name:<14}{stats.requests:>9}{stats.errors:>8}{stats.throughput:>8.1f}"
+            f"{stats.p50_ms:>9.0f}{stats.p95_ms:>9.0f}{stats.p99_ms:>9.0f}"
+            f"{stats.max_ms:>9.0f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test of the backend.")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--rps", type=float, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="In seconds.")
+    parser.add_argument("--upload-share", type=float, default=0.2)
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--companies", type=int, default=20)
+    parser.add_argument(
+        "--no-cache-busting",
+        action="store_true",
+        help="Upload the documents as they are, so repeated ones hit the cache.",
+    )
+    parser.add_argument("--json", type=Path, help="Also write the report here.")
+    args = parser.parse_args()
+    report = asyncio.run(
+        run_load_test(
+            url=args.url,
+            rps=args.rps,
+            duration=args.duration,
+            upload_share=args.upload_share,
+            corpus=load_corpus(args.corpus),
+            companies=args.companies,
+            bust_cache=not args.no_cache_busting,
+        )
+    )
+    print_report(report)
+    if args.json is not None:
+        args.json.write_text(report.model_dump_json(indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
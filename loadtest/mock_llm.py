@@ -0,0 +1,263 @@
+"""A local stand-in for the OpenAI chat completions API.
+
+It lets the backend be exercised end to end without network access or API quota.
+Start it with::
+
+    uv run python -m loadtest.mock_llm --port 8100 --latency lognormal --latency-ms 800
+
+and point the backend at it with ``OPENAI_BASE_URL=http://localhost:8100/v1``.
+
+Responses are replayed from ``--recordings``, keyed by the hash of the request
+messages. A request without a recording is forwarded to ``--record-from``, if given,
+and its response is saved, so that a real run over the ``backend/test_parsing`` corpus
+records it for later offline runs. Otherwise, every field requested in the prompt is
+answered with ``null``. The recordings of the corpus checked in the repository answer
+with its golden outputs, and are regenerated by `loadtest.record_corpus`.
+
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Literal
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from loguru import logger
+from pydantic import BaseModel
+
+LatencyDistribution = Literal["fixed", "uniform", "lognormal"]
+
+
+class MockSettings(BaseModel):
+    latency: LatencyDistribution = "fixed"
+    latency_ms: float = 500
+    """The mean latency of a whole response."""
+    latency_sigma: float = 0.5
+    """The shape of the lognormal distribution, i.e. how heavy its tail is."""
+    error_rate: float = 0.0
+    """The fraction of requests that fail with one of ``error_statuses``."""
+    error_statuses: list[int] = [429, 500, 503]
+    recordings_dir: Path = Path("backend/test_parsing/recordings")
+    record_from: str | None = None
+    """The base URL of the real API, used to record the missing responses."""
+    stream_pieces: int = 8
+    """In how many pieces streamed responses are sent."""
+
+
+def sample_latency(settings: MockSettings, rng: random.Random) -> float:
+    """Draws the latency of a response, in seconds."""
+    mean = settings.latency_ms / 1000
+    if settings.latency == "uniform":
+        return rng.uniform(0, 2 * mean)
+    if settings.latency == "lognormal" and mean > 0:
+        # The location is chosen so that the mean of the distribution is `mean`
+        sigma = settings.latency_sigma
+        return rng.lognormvariate(math.log(mean) - sigma**2 / 2, sigma)
+    return mean
+
+
+_CACHE_BUSTING_PATTERN = re.compile(r"\nReference: [A-Za-z]+-\d+\n")
+"""The line that `loadtest.harness` appends to the uploads, which doesn't change the
+answer. It's ignored by the recordings, at least as long as the document isn't long
+enough to be compacted."""
+
+
+def recording_key(messages: list[dict[str, Any]]) -> str:
+    messages = [
+        {**message, "content": _CACHE_BUSTING_PATTERN.sub("", message["content"])}
+        if isinstance(message.get("content"), str)
+        else message
+        for message in messages
+    ]
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+
+def requested_fields(body: dict[str, Any]) -> list[str]:
+    """Returns the fields requested in the JSON schema of the response format or,
+    without one, in the prompt."""
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return list(response_format["json_schema"]["schema"]["properties"])
+    messages = body.get("messages", [])
+    prompt = str(messages[-1].get("content", "")) if len(messages) > 0 else ""
+    return re.findall(r'"(\w+)": null', prompt)
+
+
+def _fallback_content(body: dict[str, Any]) -> str:
+    """Answers every requested field with ``null``."""
+    return json.dumps({field_name: None for field_name in requested_fields(body)})
+
+
+def create_app(
+    settings: MockSettings,
+    seed: int | None = None,
+    answer: Callable[[dict[str, Any]], str] | None = None,
+) -> FastAPI:
+    """Builds the mock API.
+
+    The requests without a recording are answered by ``answer``, if given, instead of
+    the real API, and the answers are recorded as well.
+
+    """
+    app = FastAPI(title="Mock LLM")
+    rng = random.Random(seed)
+    settings.recordings_dir.mkdir(parents=True, exist_ok=True)
+
+    async def completion_content(
+        body: dict[str, Any], authorization: str | None
+    ) -> str:
+        messages = body.get("messages", [])
+        path = settings.recordings_dir / f"{recording_key(messages)}.json"
+        if path.exists():
+            return json.loads(path.read_text(encoding="utf-8"))["content"]
+        if answer is not None:
+            content = answer(body)
+        elif settings.record_from is not None:
+            headers = {} if authorization is None else {"Authorization": authorization}
+            async with httpx.AsyncClient(base_url=settings.record_from) as client:
+                response = await client.post(
+                    "/chat/completions",
+                    json={**body, "stream": False},
+                    headers=headers,
+                    timeout=120,
+                )
+            response.raise_for_status()
+            content = response.json()["choices"][0]["message"]["content"]
+        else:
+            return _fallback_content(body)
+        path.write_text(json.dumps({"content": content}), encoding="utf-8")
+        logger.info(f"Recorded the response '{path.name}'.")
+        return content
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        latency = sample_latency(settings, rng)
+        if rng.random() < settings.error_rate:
+            await asyncio.sleep(latency / 10)
+            status = rng.choice(settings.error_statuses)
+            return JSONResponse(
+                status_code=status,
+                content={
+                    "error": {
+                        "message": f"Injected error {status}",
+                        "type": "mock_error",
+                        "code": None,
+                    }
+                },
+            )
+        content = await completion_content(body, request.headers.get("authorization"))
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        prompt_tokens = sum(
+            len(str(message.get("content", ""))) // 4
+            for message in body.get("messages", [])
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+        }
+
+        if not body.get("stream", False):
+            await asyncio.sleep(latency)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+
+        async def chunks() -> AsyncIterator[str]:
+            # A third of the latency is spent before the first token
+            await asyncio.sleep(latency / 3)
+            size = max(1, -(-len(content) // settings.stream_pieces))
+            pieces = [content[i : i + size] for i in range(0, len(content), size)]
+            for piece_idx, piece in enumerate(pieces + [None]):
+                finish_reason = "stop" if piece is None else None
+                delta = {} if piece is None else {"content": piece}
+                if piece_idx == 0:
+                    delta["role"] = "assistant"
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                    ],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if piece is not None:
+                    await asyncio.sleep(2 * latency / 3 / len(pieces))
+            if body.get("stream_options", {}).get("include_usage", False):
+                usage_chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage,
+                }
+                yield f"data: {json.dumps(usage_chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the OpenAI chat completions API."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument(
+        "--latency", choices=["fixed", "uniform", "lognormal"], default="fixed"
+    )
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--error-statuses", type=int, nargs="+", default=[429, 500, 503]
+    )
+    parser.add_argument(
+        "--recordings", type=Path, default=Path("backend/test_parsing/recordings")
+    )
+    parser.add_argument("--record-from", default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    settings = MockSettings(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        error_statuses=args.error_statuses,
+        recordings_dir=args.recordings,
+        record_from=args.record_from,
+    )
+    uvicorn.run(create_app(settings, args.seed), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Records the answers of `loadtest.mock_llm` for the ``backend/test_parsing`` corpus.
+
+Each document of the corpus is extracted by the backend against the mock LLM, which
+answers every prompt with the golden output of the document, restricted to the
+requested fields, and records the answer. Offline runs of the mock then replay the
+expected metrics instead of answering ``null``. The prompts depend on the template, on
+the schema and on how the documents are compacted, so the recordings have to be
+regenerated whenever any of them changes::
+
+    uv run python -m loadtest.record_corpus
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import Any
+
+import uvicorn
+
+from commons import FormData
+
+from .mock_llm import MockSettings, create_app, requested_fields
+
+RECORDINGS_DIR = (
+    Path(__file__).resolve().parent.parent / "backend" / "test_parsing" / "recordings"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+class GoldenAnswers:
+    """Answers the prompts with the golden output of the document being extracted."""
+
+    def __init__(self) -> None:
+        self.golden = FormData()
+
+    def __call__(self, body: dict[str, Any]) -> str:
+        return json.dumps(
+            {
+                field_name: _json_value(getattr(self.golden, field_name, None))
+                for field_name in requested_fields(body)
+            }
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Records the answers of the mock LLM for the corpus."
+    )
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS_DIR)
+    args = parser.parse_args()
+
+    port = _free_port()
+    scratch_dir = Path(tempfile.mkdtemp())
+    # The backend is configured when it's imported. Its store and cache go to a
+    # scratch directory, so that every document is actually sent to the mock
+    os.environ.update(
+        OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1",
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "recording"),
+        DB_DIR=str(scratch_dir / "db"),
+        JOBS_DIR=str(scratch_dir / "jobs"),
+        EXTRACTION_CACHE_DIR=str(scratch_dir / "cache"),
+    )
+    from backend import file_to_metrics
+    from backend.prompt import load_prompt_template
+    from backend.test_parsing.benchmark import GOLDEN_DIR, corpus_paths
+
+    # Stale recordings would never be requested again
+    args.recordings.mkdir(parents=True, exist_ok=True)
+    for path in args.recordings.glob("*.json"):
+        path.unlink()
+    answers = GoldenAnswers()
+    settings = MockSettings(latency_ms=0, recordings_dir=args.recordings)
+    server = uvicorn.Server(
+        uvicorn.Config(
+            create_app(settings, answer=answers),
+            host="127.0.0.1",
+            port=port,
+            log_level="warning",
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    async def record() -> None:
+        template_text = load_prompt_template()
+        # One document at a time, since the answers depend on the current one
+        for path in corpus_paths():
+            answers.golden = FormData.model_validate_json(
+                (GOLDEN_DIR / f"{path.stem}.json").read_bytes()
+            )
+            content_text = await file_to_metrics.file_to_text_async(
+                path.name, path.read_bytes()
+            )
+            await file_to_metrics.extract_metrics_async(content_text, template_text)
+            print(f"Recorded {path.name}.")
+
+    try:
+        asyncio.run(record())
+    finally:
+        server.should_exit = True
+        thread.join()
+        file_to_metrics.parse_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""The CPU-bound parsing of the uploaded documents, which the backend runs in the
+worker processes of its parse pool.
+
+This package must not import `backend`, whose import creates the app with its LLM
+clients, caches and stores: every worker would do the same.
+
+"""
@@ -0,0 +1,168 @@
+import email
+import email.policy
+import re
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from email.utils import parseaddr
+from html.parser import HTMLParser
+
+from .spreadsheet import workbook_to_text
+
+_SPREADSHEET_SUFFIXES = (".xlsx", ".xls")
+_TEXT_SUFFIXES = (".txt", ".csv", ".md")
+_REPLY_HEADER_PATTERN = re.compile(
+    r"""^\s*(?:
+    (?:On|El|Le|Am|Il)\s.{0,200}(?:wrote|escribió|a\ écrit|schrieb|ha\ scritto)\s*:
+    |-{2,}\s*(?:Original\ Message|Mensaje\ original|Message\ d'origine)\s*-{2,}
+    )\s*$""",
+    re.IGNORECASE | re.VERBOSE,
+)
+_FORWARD_PATTERN = re.compile(
+    r"^\s*-{2,}\s*(?:Forwarded message|Mensaje reenviado|Message transféré)\s*-{2,}\s*$",
+    re.IGNORECASE,
+)
+_FORWARD_HEADER_LINES = 6
+_OUTLOOK_FROM_PATTERN = re.compile(r"^\s*(?:From|De|Von):\s", re.IGNORECASE)
+_OUTLOOK_SENT_PATTERN = re.compile(
+    r"^\s*(?:Sent|Date|Enviado|Fecha|Envoyé|Gesendet):\s", re.IGNORECASE
+)
+
+
+class MailParseError(ValueError):
+    """Raised when a message, or one of its attachments, isn't what it claims to be."""
+
+
+@dataclass
+class MailDocument:
+    name: str
+    """``body`` for the text of the email, otherwise the name of the attachment."""
+    text: str
+
+
+@dataclass
+class ParsedMessage:
+    message_id: str | None
+    sender: str | None
+    subject: str | None
+    documents: list[MailDocument] = field(default_factory=list)
+    errors: list[tuple[str, str]] = field(default_factory=list)
+    """The attachments that couldn't be read, with the reason."""
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.parts: list[str] = []
+        self._skipped = 0
+
+    def handle_starttag(self, tag: str, attrs: object) -> None:
+        if tag in ("script", "style"):
+            self._skipped += 1
+        elif tag in ("br", "p", "div", "tr", "li", "h1", "h2", "h3"):
+            self.parts.append("\n")
+        elif tag in ("td", "th"):
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in ("script", "style"):
+            self._skipped = max(self._skipped - 1, 0)
+
+    def handle_data(self, data: str) -> None:
+        if self._skipped == 0:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def strip_quoted_history(text: str) -> str:
+    """Removes the earlier messages of a thread that a reply quotes.
+
+    Quoted lines, i.e. starting with ``>``, are dropped, and the text is cut at the
+    first reply header, like ``On Mon, ... wrote:``, ``El lun, ... escribió:`` or the
+    ``From:``/``Sent:`` block of Outlook. Forwarded messages are kept, since their
+    content is usually the update itself.
+
+    """
+    lines = text.replace("\r\n", "\n").split("\n")
+    kept: list[str] = []
+    forward_header_end = -1
+    for idx, line in enumerate(lines):
+        if _REPLY_HEADER_PATTERN.match(line):
+            break
+        if _FORWARD_PATTERN.match(line):
+            # The headers of a forwarded message look like the ones of a reply
+            forward_header_end = idx + _FORWARD_HEADER_LINES
+        elif (
+            idx > forward_header_end
+            and _OUTLOOK_FROM_PATTERN.match(line)
+            and any(
+                _OUTLOOK_SENT_PATTERN.match(next_line)
+                for next_line in lines[idx + 1 : idx + 4]
+            )
+        ):
+            break
+        if line.lstrip().startswith(">"):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def _body_text(message: EmailMessage) -> str | None:
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return None
+    content = part.get_content()
+    if not isinstance(content, str):
+        return None
+    if part.get_content_subtype() == "html":
+        content = html_to_text(content)
+    return content
+
+
+def parse_message(raw: bytes) -> ParsedMessage:
+    """Parses a raw email into the documents worth extracting metrics from.
+
+    These are the body, without the quoted thread history, and the spreadsheet and
+    text attachments, with the spreadsheets already converted to text. Documents
+    without any digit can't contain metrics and are left out.
+
+    This is CPU-bound, so it runs in a worker process.
+
+    """
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    if not isinstance(message, EmailMessage):
+        raise MailParseError("The content isn't an email message.")
+    parsed = ParsedMessage(
+        message_id=message.get("Message-ID"),
+        sender=parseaddr(str(message.get("From", "")))[1] or None,
+        subject=message.get("Subject"),
+    )
+    texts: list[tuple[str, str]] = []
+    body = _body_text(message)
+    if body is not None:
+        texts.append(("body", strip_quoted_history(body)))
+    for attachment in message.iter_attachments():
+        file_name = attachment.get_filename() or ""
+        lower_name = file_name.lower()
+        if not lower_name.endswith(_SPREADSHEET_SUFFIXES + _TEXT_SUFFIXES):
+            continue
+        try:
+            payload = attachment.get_payload(decode=True)
+            if not isinstance(payload, bytes):
+                raise MailParseError("The attachment has no content.")
+            if lower_name.endswith(_SPREADSHEET_SUFFIXES):
+                texts.append((file_name, workbook_to_text(payload, file_name)))
+            else:
+                charset = attachment.get_content_charset() or "utf-8"
+                texts.append((file_name, payload.decode(charset, errors="replace")))
+        except Exception as e:
+            parsed.errors.append((file_name, f"Couldn't read the attachment: {e}"))
+    for name, text in texts:
+        if any(character.isdigit() for character in text):
+            parsed.documents.append(MailDocument(name, text))
+    return parsed
@@ -0,0 +1,101 @@
+import csv
+import io
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Iterable
+
+import pandas as pd
+from openpyxl import load_workbook
+
+MAX_ROWS_PER_SHEET = int(os.getenv("EXCEL_MAX_ROWS_PER_SHEET", "1000"))
+"""How many non-empty rows of each sheet are kept at most."""
+
+
+def _format_cell(value: Any) -> str:
+    """Formats a cell as compactly as possible, e.g. ``1780000.0`` as ``1780000``."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return format(value.normalize(), "f")
+    return str(value).strip()
+
+
+def _has_numbers(rows: list[list[str]]) -> bool:
+    for row in rows:
+        for cell in row:
+            if any(char.isdigit() for char in cell):
+                return True
+    return False
+
+
+def _sheet_to_rows(rows: Iterable[Iterable[Any]]) -> list[list[str]]:
+    """Formats the cells of a sheet, dropping the empty rows and columns."""
+    kept: list[list[str]] = []
+    for row in rows:
+        cells = [_format_cell(value) for value in row]
+        if any(cell != "" for cell in cells):
+            kept.append(cells)
+            if len(kept) >= MAX_ROWS_PER_SHEET:
+                break
+    if len(kept) == 0:
+        return kept
+    width = max(len(row) for row in kept)
+    for row in kept:
+        row.extend([""] * (width - len(row)))
+    used_columns = [
+        column_idx
+        for column_idx in range(width)
+        if any(row[column_idx] != "" for row in kept)
+    ]
+    return [[row[column_idx] for column_idx in used_columns] for row in kept]
+
+
+def _sheets_to_text(sheets: Iterable[tuple[str, Iterable[Iterable[Any]]]]) -> str:
+    """Renders the relevant sheets of a workbook as CSV.
+
+    Sheets without any number can't contain metrics and are left out. When more than
+    one sheet is kept, each one is introduced by its name.
+
+    """
+    rendered: list[tuple[str, str]] = []
+    for sheet_name, rows in sheets:
+        table = _sheet_to_rows(rows)
+        if not _has_numbers(table):
+            continue
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(table)
+        rendered.append((sheet_name, buffer.getvalue()))
+    if len(rendered) == 1:
+        return rendered[0][1]
+    return "\n".join(f"# Sheet: {sheet_name}\n{text}" for sheet_name, text in rendered)
+
+
+def workbook_to_text(file_bytes: bytes, file_name: str = "") -> str:
+    """Converts the in-memory contents of a spreadsheet into a compact CSV text.
+
+    ``.xlsx`` workbooks are streamed in read-only mode, so only one row at a time is
+    materialized while reading. Hidden sheets, empty rows and empty columns are
+    dropped. Legacy ``.xls`` files go through pandas, which requires ``xlrd``.
+
+    """
+    if file_name.lower().endswith(".xls"):
+        frames = pd.read_excel(io.BytesIO(file_bytes), sheet_name=None, header=None)
+        return _sheets_to_text(
+            (str(sheet_name), df.itertuples(index=False))
+            for sheet_name, df in frames.items()
+        )
+
+    workbook = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        return _sheets_to_text(
+            (worksheet.title, worksheet.iter_rows(values_only=True))
+            for worksheet in workbook.worksheets
+            if worksheet.sheet_state == "visible"
+        )
+    finally:
+        workbook.close()
@@ -48,6 +48,8 @@ def main() -> None:
         "backend",
         "commons",
         "frontend",
+        "loadtest",
+        "parsing",
         "pre_commit_script.py",
         "rxconfig.py",
     ]